@@ -1,3 +1,4 @@
+from itertools import chain
 import shlex
 import string
 
@@ -8,6 +9,7 @@ from django.db.models import Q
 from django.utils.html import mark_safe
 from django.utils.text import get_text_list
 
+from agda.query import search_like
 from core import fasta
 
 
@@ -362,13 +364,16 @@ def clean_like(self, queryset, field_name, value):
 
 
 def clean_wildcard_like(queryset, field_name, value):
+    params = []
+    for term in shlex.split(str(value)):
+        params.append('%' + term.replace('*', '%').strip('%') + '%')
+    indexed = search_like(queryset, field_name, params)
+    if indexed is not None:
+        return indexed
     meta = queryset.model._meta
     _qn = connection.ops.quote_name
     column = (f.column for f in meta.fields if f.name == field_name).next()
     templ = '%s.%s LIKE %%s' % (_qn(meta.db_table), _qn(column))
-    params = []
-    for term in shlex.split(str(value)):
-        params.append('%' + term.replace('*', '%').strip('%') + '%')
     where = [' OR '.join([templ] * len(params))]
     return queryset.extra(where=where, params=params)
 
@@ -382,6 +387,9 @@ def clean_species_code(queryset, field_name, value):
         if len(code) > 5:
             raise ValidationError('Give one or more Uniprot species codes, e.g: HUMAN, 9TURD or RAT.')
         q.append(Q(uniprot_id__endswith=code))
+    indexed = search_like(queryset, 'uniprot_id', ['%' + code for code in codes])
+    if indexed is not None:
+        return indexed
     return queryset.filter(reduce(lambda a, b: a | b, q))
 
 division_codes = {'Unassigned': 'Una',
@@ -452,7 +460,11 @@ class FastaCleaner(object):
                  max_sequences=None):
         self.chars = set(chars or self.chars)
         self.id_chars = set(id_chars or self.id_chars)
-        self.description_chars = set(chars or self.description_chars)
+        self.description_chars = set(description_chars or self.description_chars)
+        # The same as strs, to find illegal chars with str.translate().
+        self.legal_chars = ''.join(self.chars)
+        self.legal_id_chars = ''.join(self.id_chars)
+        self.legal_description_chars = ''.join(self.description_chars)
         self.unique_ids = unique_ids
         self.default_id = default_id
         self.min_length = min_length
@@ -460,45 +472,111 @@ class FastaCleaner(object):
         self.min_sequences = min_sequences
         self.max_sequences = max_sequences
 
+    def check_count(self, count):
+        plural = lambda num: 's' if num > 1 else ''
+        if count < self.min_sequences:
+            raise ValidationError('Requires at least %s sequence%s.' % (self.min_sequences, plural(self.min_sequences)))
+        if self.max_sequences is not None and count > self.max_sequences:
+            raise ValidationError('Allows at most %s sequence%s.' % (self.max_sequences, plural(self.max_sequences)))
+
+    def check_entry(self, i, entry, ids):
+        """Validate entry number i, given the set of ids of all entries before it."""
+        alias = str(i + 1) + ' ' + entry.id
+        if len(entry) < self.min_length:
+            raise ValidationError('Sequence %s is shorter than the required length %s.' % (alias, self.min_length))
+        if self.max_length and len(entry) > self.max_length:
+            raise ValidationError('Sequence %s is longer than the allowed length %s.' % (alias, self.max_length))
+        if self.unique_ids:
+            if entry.id in ids:
+                raise ValidationError('Id of sequence %s is not unique.' % alias)
+            ids.add(entry.id)
+        if entry.sequence.translate(None, self.legal_chars):
+            illegal_chars = get_text_list(["'%s'" % ch for ch in set(entry.sequence) - self.chars], 'and')
+            raise ValidationError("Sequence %s has illegal characters %s." % (alias, illegal_chars))
+        if entry.id.translate(None, self.legal_id_chars):
+            illegal_id_chars = get_text_list(["'%s'" % ch for ch in set(entry.id) - self.id_chars], 'and')
+            raise ValidationError("Id of sequence %s has illegal characters %s." % (alias, illegal_id_chars))
+        if entry.description.translate(None, self.legal_description_chars):
+            illegal_description_chars = get_text_list(["'%s'" % ch for ch in set(entry.description) - self.description_chars], 'and')
+            raise ValidationError("Description of sequence %s has illegal characters %s." % (alias, illegal_description_chars))
+
     def clean(self, plaintext):
+        """Parse and validate plaintext, and return a FastaList of its entries.
+
+        The number of entries is checked before anything is parsed, and each
+        entry is then checked as soon as it is parsed, so invalid input is
+        rejected as early as possible.
+        """
         try:
             plaintext = str(plaintext)
         except UnicodeError, e:
             raise ValidationError('Sequence seems to contain illegal characters.')
         try:
             try:
-                entries = fasta.entries(plaintext)
+                count = fasta.count_entries(plaintext)
             except fasta.FormatError:
                 if not self.default_id:
                     raise
-                entries = fasta.entries((">%s\n" % self.default_id) + plaintext)
+                plaintext = (">%s\n" % self.default_id) + plaintext
+                count = fasta.count_entries(plaintext)
         except fasta.FastaError, e:
             raise ValidationError(e.message)
-
-        plural = lambda num: 's' if num > 1 else ''
-        if len(entries) < self.min_sequences:
-            raise ValidationError('Requires at least %s sequence%s.' % (self.min_length, plural(self.min_sequences)))
-        if self.max_sequences is not None and len(entries) > self.max_sequences:
-            raise ValidationError('Allows at most %s sequence%s.' % (self.min_length, plural(self.max_sequences)))
+        self.check_count(count)
+        entries = fasta.FastaList()
+        if not count:
+            return entries
         ids = set([])
-        for i, entry in enumerate(entries):
-            alias = str(i + 1) + ' ' + entry.id
-            if len(entry) < self.min_length:
-                raise ValidationError('Sequence %s is shorter than the required length %s.' % (alias, self.min_length))
-            if self.max_length and len(entry) > self.max_length:
-                raise ValidationError('Sequence %s is longer than the allowed length %s.' % (alias, self.max_length))
-            if self.unique_ids:
-                if entry.id in ids:
-                    raise ValidationError('Id of sequence %s is not unique.' % alias)
-                ids.add(entry.id)
-            illegal_chars = get_text_list(["'%s'" % ch for ch in set(entry.sequence) - self.chars], 'and')
-            if illegal_chars:
-                raise ValidationError("Sequence%s has illegal characters %s." % (alias, illegal_chars))
-            illegal_id_chars = get_text_list(["'%s'" % ch for ch in set(entry.id) - self.id_chars], 'and')
-            if illegal_id_chars:
-                raise ValidationError("Id of sequence %s has illegal characters %s." % (alias, illegal_id_chars))
-            illegal_description_chars = get_text_list(["'%s'" % ch for ch in set(entry.description) - self.description_chars], 'and')
-            if illegal_description_chars:
-                raise ValidationError("Description of sequence %s has illegal characters %s." % (alias, illegal_description_chars))
-
+        for i, entry in enumerate(fasta.iter_entries(plaintext)):
+            self.check_entry(i, entry, ids)
+            entries.append(entry)
         return entries
+
+    def iter_ascii_chunks(self, upload):
+        """Iterate over the chunks of upload, which must be ASCII text.
+
+        Uploads are bytes, and anything else, e.g: UTF-8 or UTF-16 text or a
+        gzipped file, could not be listed in error messages.
+        """
+        for chunk in fasta.iter_chunks(upload):
+            try:
+                chunk.decode('ascii')
+            except UnicodeDecodeError:
+                raise ValidationError('File seems to contain illegal characters, only plain text fasta files are allowed.')
+            yield chunk
+
+    def clean_file(self, upload, out=None):
+        """Streaming clean() for uploaded files.
+
+        Validates the entries in the file upload as they are read, and writes
+        them to the file out if given, so that they are never all in memory
+        at once. upload must support seek(), as it is read twice.
+
+        Returns
+        -------
+        A (sequences, residues) tuple with the number of entries and the total
+        number of residues in them.
+        """
+        header = ''
+        try:
+            try:
+                upload.seek(0)
+                count = fasta.count_entries(self.iter_ascii_chunks(upload))
+            except fasta.FormatError:
+                if not self.default_id:
+                    raise
+                header = ">%s\n" % self.default_id
+                upload.seek(0)
+                count = fasta.count_entries(chain([header], self.iter_ascii_chunks(upload)))
+        except fasta.FastaError, e:
+            raise ValidationError(e.message)
+        self.check_count(count)
+        residues = 0
+        if count:
+            upload.seek(0)
+            ids = set([])
+            for i, entry in enumerate(fasta.iter_entries(chain([header], self.iter_ascii_chunks(upload)))):
+                self.check_entry(i, entry, ids)
+                residues += len(entry)
+                if out is not None:
+                    entry.write_to(out)
+        return count, residues
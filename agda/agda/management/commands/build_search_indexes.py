@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import get_app, get_models
+
+from agda.query import LocalSearchIndex
+
+
+class Command(BaseCommand):
+    args = '<app_label app_label ...>'
+    help = 'Build local search indexes for models with fulltext indexes, see SEARCH_BACKEND.'
+
+    def handle(self, *app_labels, **options):
+        if app_labels:
+            models = [m for label in app_labels for m in get_models(get_app(label))]
+        else:
+            models = get_models()
+        for model in models:
+            if not hasattr(model, 'fulltext_indexes'):
+                continue
+            index = LocalSearchIndex(model)
+            print "Indexing %s in %s" % (model._meta.db_table, index.path)
+            index.build()
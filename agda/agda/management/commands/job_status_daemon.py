@@ -0,0 +1,55 @@
+from optparse import make_option
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.models import get_live_jobs
+from jobs.transitions import update_status_for_jobs
+
+from profiles.models import get_system_user
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Continuously sync the status of all live jobs with their '
+            'schedulers, so that results views never need to ask the '
+            'scheduler themselves.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval',
+                    type='float',
+                    default=None,
+                    help='Seconds between scheduler polls (default: settings.JOB_STATUS_SYNC_INTERVAL).'),
+        make_option('--once',
+                    action='store_true',
+                    default=False,
+                    help='Sync once and exit.'),
+    )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        if interval is None:
+            interval = settings.JOB_STATUS_SYNC_INTERVAL
+        user = get_system_user()
+        while True:
+            started = time.time()
+            try:
+                self.sync(user)
+            except Exception:
+                # A scheduler hiccup must not bring the daemon down, the next
+                # round will try again.
+                logger.exception('job status sync failed')
+            if options['once']:
+                return
+            # Do not hold on to a connection the database may time out.
+            close_old_connections()
+            time.sleep(max(0, interval - (time.time() - started)))
+
+    def sync(self, user):
+        jobs = get_live_jobs().exclude(scheduler_id=None)
+        if jobs:
+            update_status_for_jobs(user, jobs)
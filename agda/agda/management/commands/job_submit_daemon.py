@@ -0,0 +1,62 @@
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.queue import submit_queued_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Continuously submit queued jobs to their schedulers, so that '
+            'job submission views never need to wait for the scheduler.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers',
+                    type='int',
+                    default=None,
+                    help='Number of parallel submissions (default: settings.JOB_SUBMIT_WORKERS).'),
+        make_option('--interval',
+                    type='float',
+                    default=None,
+                    help='Seconds between queue polls when idle (default: settings.JOB_SUBMIT_POLL_INTERVAL).'),
+        make_option('--once',
+                    action='store_true',
+                    default=False,
+                    help='Submit one batch and exit.'),
+    )
+
+    # Seconds to pause all submissions when the scheduler is busy. Doubled
+    # for each consecutive busy batch, up to max_backoff.
+    backoff = 5
+    max_backoff = 300
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or settings.JOB_SUBMIT_WORKERS
+        interval = options['interval']
+        if interval is None:
+            interval = settings.JOB_SUBMIT_POLL_INTERVAL
+        pool = ThreadPool(workers)
+        busy = threading.Event()
+        backoff = self.backoff
+        while True:
+            busy.clear()
+            try:
+                handled = submit_queued_jobs(pool, workers * 4, busy)
+            except Exception:
+                logger.exception('job submission failed')
+                handled = 0
+            if options['once']:
+                return
+            if busy.is_set():
+                time.sleep(backoff)
+                backoff = min(self.max_backoff, backoff * 2)
+                continue
+            backoff = self.backoff
+            if not handled:
+                time.sleep(interval)
@@ -1,9 +1,7 @@
 from django.core.management.base import BaseCommand
 
-from jobs.models import (JOB_STATUS_LEVEL_ACCEPTED,
-                         JOB_STATUS_LEVEL_FINISHED,
-                         Job,
-                         update_status_for_jobs)
+from jobs.models import get_live_jobs
+from jobs.transitions import update_status_for_jobs
 
 from profiles.models import get_system_user
 
@@ -15,10 +13,7 @@ class Command(BaseCommand):
     help = 'Update status for alive slurm jobs.'
 
     def handle(self, *slugs, **options):
-        jobs = (Job.objects.select_subclasses()
-                .filter(scheduler='slurm')
-                .filter(status__gte=JOB_STATUS_LEVEL_ACCEPTED)
-                .filter(status__lt=JOB_STATUS_LEVEL_FINISHED))
+        jobs = get_live_jobs(scheduler='slurm')
         if slugs:
             jobs = jobs.filter(slug__in=slugs)
         if jobs:
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from mdr.models import family_registry
+from mdr.views import render_family_page
+
+
+class Command(BaseCommand):
+    args = '<family_id family_id ...>'
+    help = 'Render MDRLookup results into the family page cache, see MDR_FAMILY_PAGE_CACHE.'
+
+    def handle(self, *family_ids, **options):
+        family_registry.clear()
+        family_ids = family_ids or sorted(family_registry.families)
+        for family_id in family_ids:
+            render_family_page(family_id)
+        print "Rendered %s family pages." % len(family_ids)
@@ -1,3 +1,10 @@
+from itertools import islice
+import os
+import re
+import sqlite3
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models, connection
 from django.db.models.base import ModelBase
 from django.db.models.query import QuerySet
@@ -138,12 +145,247 @@ def setup_fulltext_indexes(sender, **kw):
 
     fulltext_indexes should be a list of fields or field names, or a index name
     to field list dictionary to set up multiple named indexes.
+
+    Does nothing with SEARCH_BACKEND = 'local', which leaves the tables free
+    to use any storage engine.
     """
     if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.mysql':
         return
+    if settings.SEARCH_BACKEND == 'local':
+        return
     for name in dir(sender):
         model = getattr(sender, name)
         if not (isinstance(model, ModelBase) and hasattr(model, 'fulltext_indexes')):
             continue
         for name, fields in get_fulltext_indexes(model).items():
             setup_fulltext_index(model, fields, 'fulltext_' + name)
+
+
+# Local fulltext search.
+
+SEARCH_TERM = re.compile(r'[~<>()]*([+-]?)[~<>()]*("[^"]*"?|[^\s"]+)')
+
+
+def to_fts_query(query):
+    """Translate a MySQL boolean mode fulltext query to an SQLite FTS5 query.
+
+    Words prefixed with + are required and words prefixed with - excluded.
+    Without required words, any of the other words must be present. Phrases
+    in double quotes and prefix searches with a * suffix work as in MySQL.
+    Returns None for queries that match nothing.
+    """
+    required = []
+    optional = []
+    excluded = []
+    for operator, term in SEARCH_TERM.findall(query):
+        term = term.strip('"()')
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if not term:
+            continue
+        term = '"%s"' % term.replace('"', '""') + (' *' if prefix else '')
+        if operator == '+':
+            required.append(term)
+        elif operator == '-':
+            excluded.append(term)
+        else:
+            optional.append(term)
+    if required:
+        match = ' AND '.join(required)
+    elif optional:
+        match = ' OR '.join(optional)
+    else:
+        return None
+    if excluded:
+        match = '(%s) NOT (%s)' % (match, ' OR '.join(excluded))
+    return match
+
+
+# The trigram tokenizer of the wildcard tables came with SQLite 3.34.
+SQLITE_MIN_VERSION = (3, 34, 0)
+
+
+def check_sqlite_version():
+    """Raise ImproperlyConfigured if the SQLite library is too old for LocalSearchIndex."""
+    if sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+        raise ImproperlyConfigured('The local search backend requires SQLite %s or later, found %s.'
+                                   % ('.'.join(str(n) for n in SQLITE_MIN_VERSION), sqlite3.sqlite_version))
+
+
+def get_field_names(fields):
+    return [f if isinstance(f, basestring) else f.name for f in fields]
+
+
+class LocalSearchIndex(object):
+    """An SQLite FTS5 index of the fulltext_indexes of a model, in a file.
+
+    Has a table for each named index, with the primary keys of the model as
+    rowids, so the model must have an integer primary key. The file is
+    built by build(), e.g: with the build_search_indexes management command,
+    and must be rebuilt whenever the model table changes.
+
+    The fields listed in the wildcard_indexes attribute of the model, if any,
+    are also indexed by trigrams in a 'wildcard' table, for LIKE queries on
+    single fields, see search_like().
+    """
+    wildcard_table = 'wildcard'
+
+    def __init__(self, model, path=None):
+        self.model = model
+        self.indexes = get_fulltext_indexes(model)
+        self.wildcard_fields = get_field_names(getattr(model, 'wildcard_indexes', ()))
+        if path is None:
+            path = os.path.join(settings.SEARCH_INDEX_ROOT, model._meta.db_table + '.sqlite')
+        self.path = path
+        self.local = threading.local()
+
+    def get_fields(self, index):
+        return get_field_names(self.indexes[index])
+
+    def get_table(self, index):
+        return 'fulltext_' + index
+
+    def connect(self):
+        """Return a connection to the index file for the current thread.
+
+        A new connection is opened, and the old one closed, if the file has
+        been rebuilt since.
+        """
+        check_sqlite_version()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            raise ImproperlyConfigured('No search index %s, run manage.py build_search_indexes.' % self.path)
+        if getattr(self.local, 'mtime', None) != mtime:
+            if getattr(self.local, 'connection', None) is not None:
+                self.local.connection.close()
+            self.local.connection = sqlite3.connect(self.path)
+            self.local.mtime = mtime
+        return self.local.connection
+
+    def build(self, queryset=None, batch_size=10000):
+        """Index all rows in queryset, or in the model table, and replace the index file."""
+        check_sqlite_version()
+        if queryset is None:
+            queryset = self.model._default_manager.all()
+        fields = set(self.wildcard_fields)
+        for index in self.indexes:
+            fields.update(self.get_fields(index))
+        fields = sorted(fields)
+        tmp_path = self.path + '.tmp'
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        db = sqlite3.connect(tmp_path)
+        tables = [(self.get_table(index), self.get_fields(index),
+                   "content='', prefix='2 3', tokenize=\"unicode61 tokenchars '_'\"")
+                  for index in sorted(self.indexes)]
+        if self.wildcard_fields:
+            # Trigram tables keep their content, which LIKE needs to check matches.
+            tables.append((self.wildcard_table, self.wildcard_fields, "tokenize='trigram'"))
+        inserts = []
+        for table, table_fields, options in tables:
+            db.execute('CREATE VIRTUAL TABLE %s USING fts5(%s, %s)' % (table, ', '.join(table_fields), options))
+            sql = 'INSERT INTO %s (rowid, %s) VALUES (?%s)' % (table, ', '.join(table_fields), ', ?' * len(table_fields))
+            columns = [0] + [fields.index(name) + 1 for name in table_fields]
+            inserts.append((sql, columns))
+        rows = queryset.values_list('pk', *fields).iterator()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            for sql, columns in inserts:
+                db.executemany(sql, ([row[i] for i in columns] for row in batch))
+        db.commit()
+        db.close()
+        os.rename(tmp_path, self.path)
+
+    def search(self, query, index='default', limit=None):
+        """Return (pk, relevance) tuples of the rows that match a MySQL boolean
+        mode query, best match first, and at most limit of them if given.
+
+        Relevance is the negated bm25() score, so higher is better as with
+        MySQL MATCH().
+        """
+        match = to_fts_query(query)
+        if match is None:
+            return []
+        table = self.get_table(index)
+        sql = 'SELECT rowid, -bm25(%s) AS relevance FROM %s WHERE %s MATCH ? ORDER BY relevance DESC' % (table, table, table)
+        params = (match,)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params += (limit,)
+        return self.connect().execute(sql, params).fetchall()
+
+    def search_like(self, field_name, patterns, limit=None):
+        """Return the primary keys of the rows where field_name is LIKE any of patterns.
+
+        Case insensitive, as in MySQL. Patterns with at least three
+        consecutive characters besides wildcards are looked up by trigrams,
+        shorter ones scan the table. Returns None if more than limit rows
+        match, if given.
+        """
+        pks = set()
+        sql = 'SELECT rowid FROM %s WHERE %s LIKE ?' % (self.wildcard_table, field_name)
+        db = self.connect()
+        for pattern in patterns:
+            for row in db.execute(sql, (pattern,)):
+                pks.add(row[0])
+                if limit is not None and len(pks) > limit:
+                    return None
+        return pks
+
+
+search_indexes = {}
+
+
+def get_search_index(model):
+    """Return the LocalSearchIndex of a model with fulltext_indexes, in SEARCH_INDEX_ROOT."""
+    key = (model, settings.SEARCH_INDEX_ROOT)
+    index = search_indexes.get(key)
+    if index is None:
+        index = search_indexes[key] = LocalSearchIndex(model)
+    return index
+
+
+def search_like(queryset, field_name, patterns):
+    """Filter queryset on field_name LIKE any of patterns, using the wildcard index if possible.
+
+    Returns None unless SEARCH_BACKEND = 'local' and field_name is in the
+    wildcard_indexes of the model, see LocalSearchIndex. Also returns None
+    for more than SEARCH_MAX_RESULTS matches, as their primary keys would be
+    passed on to the database in the query. Filter with LIKE in the database
+    instead then.
+    """
+    model = queryset.model
+    if settings.SEARCH_BACKEND != 'local' or field_name not in get_field_names(getattr(model, 'wildcard_indexes', ())):
+        return None
+    pks = get_search_index(model).search_like(field_name, patterns, settings.SEARCH_MAX_RESULTS)
+    if pks is None:
+        return None
+    return queryset.filter(pk__in=pks)
+
+
+class FulltextSearchQuerySet(MySQLFulltextSearchQuerySet):
+    """A fulltext searchable queryset, see MySQLFulltextSearchQuerySet.
+
+    With SEARCH_BACKEND = 'local', search() uses the LocalSearchIndex of the
+    model instead of MySQL fulltext indexes. The matching primary keys are
+    then passed on to the database, so only the SEARCH_MAX_RESULTS best
+    matches are kept.
+    """
+    def search(self, query, index='default', by_relevance=False, relevance_attr='relevance'):
+        if settings.SEARCH_BACKEND != 'local':
+            return super(FulltextSearchQuerySet, self).search(query, index, by_relevance, relevance_attr)
+        hits = get_search_index(self.model).search(query, index, settings.SEARCH_MAX_RESULTS)
+        queryset = self.filter(pk__in=[pk for pk, relevance in hits])
+        if not (by_relevance and hits):
+            return queryset
+        _q = connection.ops.quote_name
+        pk_column = "%s.%s" % (_q(self.model._meta.db_table), _q(self.model._meta.pk.column))
+        relevance = "CASE %s %s END" % (pk_column, " ".join(["WHEN %s THEN %s"] * len(hits)))
+        return queryset.extra(select={relevance_attr: relevance},
+                              select_params=[value for hit in hits for value in hit],
+                              order_by=['-' + relevance_attr])
@@ -120,6 +120,11 @@ CACHES = {
         'LOCATION': '/tmp/agda/cache',
         'MAX_ENTRIES': 200000,
     },
+    'events': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': 'agda',
+    },
 }
 ########## END CACHE CONFIGURATION
 
@@ -188,6 +193,68 @@ RESULTDIR_URL = os.path.join(MEDIA_URL, 'results/')
 # Root directory for failed grid jobs
 ERRORDIR_ROOT = os.path.join(PROJECT_ROOT, 'failed')
 
+# Seconds between scheduler polls in the job_status_daemon management command,
+# which keeps the status of all live jobs up to date in the database.
+JOB_STATUS_SYNC_INTERVAL = 10
+
+# Worker threads for saving result files etc. when updating job status in bulk.
+JOB_STATUS_WORKERS = 4
+
+# How to talk to slurm: 'command' runs sbatch, squeue etc. in a subprocess,
+# 'rest' sends JSON requests to slurmrestd over keep-alive connections.
+SLURM_TRANSPORT = 'command'
+SLURMRESTD_URL = 'http://localhost:6820'
+SLURMRESTD_USER = None
+SLURMRESTD_TOKEN = None
+SLURMRESTD_VERSION = 'v0.0.39'
+# Environment of jobs submitted through slurmrestd, as a dict. None passes on
+# the environment of the submitting process, as sbatch does, so that job
+# scripts find the same PATH, PYTHONPATH, LD_LIBRARY_PATH and modules.
+SLURMRESTD_JOB_ENVIRONMENT = None
+
+# Parallel submissions and seconds between queue polls when idle in the
+# job_submit_daemon management command, which submits queued jobs.
+JOB_SUBMIT_WORKERS = 4
+JOB_SUBMIT_POLL_INTERVAL = 1
+
+# Jobs with many query sequences (MDRScan, NoduleBlast) are split into at most
+# JOB_ARRAY_MAX_SHARDS shards of at least JOB_ARRAY_MIN_SHARD_SEQUENCES
+# sequences each, and run as slurm job arrays with one task per shard.
+JOB_ARRAY_MAX_SHARDS = 16
+JOB_ARRAY_MIN_SHARD_SEQUENCES = 50
+
+# Results pages wait for job status changes with the jobs.views.wait_for_status
+# long-poll view, which answers after at most JOB_STATUS_WAIT_TIMEOUT seconds
+# and checks for changes every JOB_STATUS_WAIT_POLL_INTERVAL seconds. Status
+# changes are published in JOB_STATUS_EVENTS_CACHE for JOB_STATUS_EVENTS_TTL
+# seconds. It must be shared between processes, so not a local memory cache,
+# and is read by every waiting client, so not the filesystem cache either.
+JOB_STATUS_WAIT_TIMEOUT = 25
+JOB_STATUS_WAIT_POLL_INTERVAL = 0.5
+JOB_STATUS_EVENTS_CACHE = 'events'
+JOB_STATUS_EVENTS_TTL = 24 * 60 * 60
+
+# The MDR data release in the database and DATA_ROOT. MDRLookup results are
+# cached in MDR_FAMILY_PAGE_CACHE per release, family and page templates. Warm
+# the cache with the warm_family_pages management command after data imports.
+MDR_RELEASE = '2010.1'
+MDR_FAMILY_PAGE_CACHE = 'filesystem'
+
+# Fulltext search backend for models with fulltext_indexes (MDR members):
+# 'mysql' uses MySQL fulltext indexes, which require MyISAM tables, 'local' an
+# SQLite index file per model in SEARCH_INDEX_ROOT. Local indexes are built by
+# the build_search_indexes management command, rerun it after data imports.
+# Local searches keep the SEARCH_MAX_RESULTS best matches, as their primary
+# keys are passed on to the database in the query. Wildcard criteria with more
+# matches are filtered with LIKE in the database instead.
+SEARCH_BACKEND = 'mysql'
+SEARCH_INDEX_ROOT = os.path.join(PROJECT_ROOT, 'search')
+SEARCH_MAX_RESULTS = 10000
+
+# Default and max number of jobs per page in job lists (web and api).
+JOB_LIST_PAGE_SIZE = 100
+JOB_LIST_MAX_PAGE_SIZE = 1000
+
 # Settings for uploaded files that are cached server side until form is
 # correctly filled out.
 CACHED_UPLOAD_DIR = os.path.join(PROJECT_ROOT, 'upload')
@@ -0,0 +1,84 @@
+import gzip
+from StringIO import StringIO
+
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
+
+from agda.forms import FastaCleaner
+
+
+class TestFastaCleaner(SimpleTestCase):
+    def assertInvalid(self, cleaner, plaintext, message):
+        """Check that both clean() and clean_file() reject plaintext with message."""
+        for clean in cleaner.clean, lambda text: cleaner.clean_file(StringIO(text)):
+            try:
+                clean(plaintext)
+            except ValidationError, e:
+                self.assertEquals(e.messages, [message])
+            else:
+                self.fail('%r was not rejected' % plaintext)
+
+    def test_clean(self):
+        plaintext = '>a one\nACDE\nFG\n>b\nHIK\n'
+        entries = FastaCleaner().clean(plaintext)
+        self.assertEquals([(e.id, e.description, e.sequence) for e in entries],
+                          [('a', 'one', 'ACDEFG'), ('b', '', 'HIK')])
+        self.assertEquals(FastaCleaner(default_id='query').clean('ACDE\n')[0].id, 'query')
+
+    def test_clean_file(self):
+        out = StringIO()
+        upload = StringIO('>a one\nACDE\nFG\n>b\nHIK\n')
+        self.assertEquals(FastaCleaner().clean_file(upload, out), (2, 9))
+        self.assertEquals(out.getvalue(), '>a one\nACDEFG\n>b\nHIK\n')
+        out = StringIO()
+        self.assertEquals(FastaCleaner(default_id='query').clean_file(StringIO('ACDE\n'), out), (1, 4))
+        self.assertEquals(out.getvalue(), '>query\nACDE\n')
+
+    def test_sequence_counts(self):
+        self.assertInvalid(FastaCleaner(), '', 'Requires at least 1 sequence.')
+        self.assertInvalid(FastaCleaner(min_sequences=2), '>a\nA\n', 'Requires at least 2 sequences.')
+        self.assertInvalid(FastaCleaner(max_sequences=2), '>a\nA\n>b\nC\n>c\nD\n', 'Allows at most 2 sequences.')
+        self.assertEquals(FastaCleaner(min_sequences=0).clean(''), [])
+
+    def test_illegal_characters(self):
+        cleaner = FastaCleaner()
+        self.assertInvalid(cleaner, '>a\nAC1D\n', "Sequence 1 a has illegal characters '1'.")
+        self.assertInvalid(cleaner, '>a#b\nACD\n', "Id of sequence 1 a#b has illegal characters '#'.")
+        self.assertInvalid(cleaner, '>a one$\nACD\n', "Description of sequence 1 a has illegal characters '$'.")
+        cleaner = FastaCleaner(chars='ACGT')
+        self.assertInvalid(cleaner, '>a\nACGU\n', "Sequence 1 a has illegal characters 'U'.")
+        self.assertEquals(len(cleaner.clean('>a one, two\nACGT\n')), 1)
+
+    def test_entry_lengths(self):
+        self.assertInvalid(FastaCleaner(), '>a\n>b\nACD\n', 'Sequence 1 a is shorter than the required length 1.')
+        self.assertInvalid(FastaCleaner(max_length=3), '>a\nACD\n>b\nACDE\n',
+                           'Sequence 2 b is longer than the allowed length 3.')
+
+    def test_error_order(self):
+        # The sequence count is checked before any entry.
+        self.assertInvalid(FastaCleaner(max_sequences=1), '>a#\n\n>a\nA1\n', 'Allows at most 1 sequence.')
+        # The first invalid entry is reported.
+        self.assertInvalid(FastaCleaner(), '>a\nA\n>b\nA1\n>c#\n\n', "Sequence 2 b has illegal characters '1'.")
+        # Within an entry: length, unique id, residues, id and description.
+        self.assertInvalid(FastaCleaner(), '>a\nA\n>a $\n\n', 'Sequence 2 a is shorter than the required length 1.')
+        self.assertInvalid(FastaCleaner(), '>a\nA\n>a $\n1\n', 'Id of sequence 2 a is not unique.')
+        self.assertInvalid(FastaCleaner(), '>a\nA\n>b# $\n1\n', "Sequence 2 b# has illegal characters '1'.")
+        self.assertInvalid(FastaCleaner(), '>a\nA\n>b# $\nA\n', "Id of sequence 2 b# has illegal characters '#'.")
+
+    def test_non_ascii_uploads(self):
+        def clean_file(cleaner, data):
+            try:
+                cleaner.clean_file(StringIO(data))
+            except ValidationError, e:
+                return e.messages
+        gzipped = StringIO()
+        gzip.GzipFile(fileobj=gzipped, mode='w').write('>a\nACD\n')
+        message = ['File seems to contain illegal characters, only plain text fasta files are allowed.']
+        for cleaner in FastaCleaner(), FastaCleaner(default_id='query'):
+            self.assertEquals(clean_file(cleaner, '>a\nAC\xc3\xa9\n'), message)
+            self.assertEquals(clean_file(cleaner, '>a caf\xc3\xa9\nACD\n'), message)
+            self.assertEquals(clean_file(cleaner, '>a\xc3\xa9\nACD\n'), message)
+            self.assertEquals(clean_file(cleaner, '>a\nACD\n'.encode('utf-16')), message)
+            self.assertEquals(clean_file(cleaner, '\x00\x01\xfe\xff>\n' * 3), message)
+            self.assertEquals(clean_file(cleaner, gzipped.getvalue()), message)
+        self.assertRaises(ValidationError, FastaCleaner().clean, u'>a\nAC\xe9\n')
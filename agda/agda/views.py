@@ -6,7 +6,8 @@ from django.contrib.auth.models import (AnonymousUser,
                                         check_password)
 
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import (HttpResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
@@ -212,6 +213,58 @@ def json_response(data, status=200, default=None):
     return HttpResponse(body, mimetype='application/json', status=status)
 
 
+class JSONObject(object):
+    """An iterable of (key, value) pairs, for iter_json() to encode as a JSON object."""
+    def __init__(self, items):
+        self.items = items
+
+
+def is_json_stream(data):
+    return isinstance(data, JSONObject) or (hasattr(data, 'next') and hasattr(data, '__iter__'))
+
+
+def iter_json(data, default=None):
+    """JSON-encode data a part at a time.
+
+    Iterators, e.g: generators, are encoded as lists and JSONObjects as
+    objects, an item at a time as they are iterated over. Dicts, lists and
+    tuples that contain any of these are also encoded an item at a time, and
+    everything else in one go, with the C speedups of the json module when
+    available. default is as for json.dumps.
+    """
+    return _iter_json(data, json.JSONEncoder(default=default).encode)
+
+
+def _iter_json(data, encode):
+    if isinstance(data, JSONObject) or (isinstance(data, dict) and any(is_json_stream(v) for v in data.itervalues())):
+        items = data.items if isinstance(data, JSONObject) else data.iteritems()
+        yield '{'
+        for i, (key, value) in enumerate(items):
+            yield (', ' if i else '') + encode(key) + ': '
+            for part in _iter_json(value, encode):
+                yield part
+        yield '}'
+    elif is_json_stream(data) or (isinstance(data, (list, tuple)) and any(is_json_stream(v) for v in data)):
+        yield '['
+        for i, item in enumerate(data):
+            if i:
+                yield ', '
+            for part in _iter_json(item, encode):
+                yield part
+        yield ']'
+    else:
+        yield encode(data)
+
+
+def json_stream_response(data, status=200, default=None):
+    """Return data JSON-encoded in a streaming response.
+
+    Like json_response(), but iterators and JSONObjects in data are encoded
+    as they are sent, and never held in memory as a whole, see iter_json().
+    """
+    return StreamingHttpResponse(iter_json(data, default), content_type='application/json', status=status)
+
+
 def script_data(data):
     """json dumps data and use Django utils mark_safe to
      Explicitly mark a string as safe for (HTML) output purposes
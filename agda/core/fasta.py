@@ -38,11 +38,45 @@ NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import (chain,
+                       islice)
+import mmap
+import multiprocessing
+import os
 import re
 from StringIO import StringIO
+import struct
+import sys
 
 GAP_CHARACTERS = '-.'
 
+# Max number of compiled regexes kept by compile_regex().
+REGEX_CACHE_SIZE = 256
+regex_cache = OrderedDict()
+
+def compile_regex(pattern, flags=re.IGNORECASE):
+    """re.compile() with a cache of the REGEX_CACHE_SIZE most recently used patterns.
+
+    Unlike the cache in the re module, this one evicts only the least
+    recently used pattern when it is full, rather than all of them.
+    """
+    key = (pattern, flags)
+    try:
+        regex = regex_cache.pop(key)
+    except KeyError:
+        regex = re.compile(pattern, flags)
+        if len(regex_cache) >= REGEX_CACHE_SIZE:
+            regex_cache.popitem(last=False)
+    regex_cache[key] = regex
+    return regex
+
+def get_gapped_motif_pattern(motif):
+    """A pattern for motif that allows gaps between any two of its chars."""
+    return ("[%s]*" % GAP_CHARACTERS).join(motif)
+
 class FastaError(Exception):
     """Base class for exceptions in the fasta module."""
     message = None
@@ -63,7 +97,15 @@ class EmptyInput(FastaError):
 class NonUniqueIDError(FastaError):
     message = "sequence id %(id)s is duplicated"
 
+class StaleCacheError(FastaError):
+    """Raised when the binary cache of a fasta file is missing or out of date."""
+    message = "no up to date binary cache for fasta file"
+
 class FastaEntry(object):
+    # Uploads may hold very many entries, so no per entry __dict__.
+    fields = ('id', 'description', 'sequence', 'line_length')
+    __slots__ = fields + ('_positions', '_positions_sequence')
+
     def __init__(self, id=None, description='', sequence='', line_length=60):
         """A fasta entry.
 
@@ -82,6 +124,16 @@ class FastaEntry(object):
         self.description = description
         self.sequence = sequence
         self.line_length = line_length
+        self._positions = self._positions_sequence = None
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.fields)
+
+    def __setstate__(self, state):
+        # Also accepts the __dict__ of entries pickled before __slots__.
+        self._positions = self._positions_sequence = None
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __len__(self):
         if self.sequence:
@@ -100,6 +152,21 @@ class FastaEntry(object):
             lsEntry.append(self.sequence[i:i + self.line_length])
         return '\n'.join(lsEntry)
 
+    def iter_lines(self):
+        """Iterate over the lines of str(self), each ending with a newline."""
+        yield self.header + '\n'
+        sequence = self.sequence
+        line_length = self.line_length
+        for i in xrange(0, len(sequence), line_length):
+            yield sequence[i:i + line_length] + '\n'
+
+    def write_to(self, f):
+        """Write the entry in plaintext to the file f, ending with a newline.
+
+        Unlike str(self), never holds more than a line of plaintext at a time.
+        """
+        f.writelines(self.iter_lines())
+
     @property
     def header(self):
         base = '>' + self.id
@@ -157,7 +224,7 @@ class FastaEntry(object):
 
         """
         if isinstance(regex, str):
-            regex = re.compile(regex, re.IGNORECASE)
+            regex = compile_regex(regex)
         return regex.search(self.sequence)
 
     def search_aligned(self, motif):
@@ -174,9 +241,31 @@ class FastaEntry(object):
         A re.match object or None.
 
         """
-        sGaps = "[%s]*" % GAP_CHARACTERS
-        r = re.compile(sGaps.join(motif), re.IGNORECASE)
-        return r.search(self.sequence)
+        return compile_regex(get_gapped_motif_pattern(motif)).search(self.sequence)
+
+    def iter_motif(self, regex):
+        """Iterate over all matches of regex in the ungapped sequence.
+
+        IN:
+        regex: <str> or <regex>
+            Strings will be compiled into case insensitive regexes. Gaps in
+            the sequence never break up a match.
+
+        OUT:
+        (start, stop) alignment index tuples using python slice notation,
+        for all non-overlapping matches.
+
+        """
+        if isinstance(regex, str):
+            regex = compile_regex(regex)
+        positions = self.residue_positions()
+        for match in regex.finditer(self.ungapped()):
+            start, stop = match.span()
+            if start == stop:
+                index = positions[start] if start < len(positions) else len(self.sequence)
+                yield (index, index)
+            else:
+                yield (positions[start], positions[stop - 1] + 1)
 
     def ungapped(self):
         """Return the sequence with all gap characters removed."""
@@ -185,6 +274,17 @@ class FastaEntry(object):
             s = s.replace(sGapChar, '')
         return s
 
+    def residue_positions(self):
+        """Return an array of the alignment index of each residue.
+
+        The array is built on first use and kept until the sequence is
+        replaced, so coordinate conversions cost O(log n) at most.
+        """
+        if self._positions_sequence is not self.sequence:
+            self._positions = array('i', [i for i, c in enumerate(self.sequence) if c not in GAP_CHARACTERS])
+            self._positions_sequence = self.sequence
+        return self._positions
+
     def alignment_index(self, sequence_index):
         """Where can the given sequence index be found in the alignment?
 
@@ -201,15 +301,23 @@ class FastaEntry(object):
         sequence is aligned.
 
         """
-        if sequence_index >= len(self.ungapped()):
+        positions = self.residue_positions()
+        if sequence_index >= len(positions):
+            raise IndexError("sequence index out of range")
+        return positions[sequence_index % len(positions)]
+
+    def alignment_indexes(self, sequence_indexes):
+        """.alignment_index() for each of the given sequence indexes, as a list."""
+        positions = self.residue_positions()
+        n = len(positions)
+        if any(i >= n for i in sequence_indexes):
             raise IndexError("sequence index out of range")
-        sequence_index %= len(self.ungapped())
-        iCurrent = -1
-        for i, sResidue in enumerate(self.sequence):
-            if sResidue not in GAP_CHARACTERS:
-                iCurrent += 1
-            if iCurrent == sequence_index:
-                return i
+        return [positions[i % n] for i in sequence_indexes]
+
+    def _check_alignment_index(self, alignment_index):
+        if not -len(self.sequence) <= alignment_index < len(self.sequence):
+            raise IndexError("alignment index out of range")
+        return alignment_index % len(self.sequence)
 
     def sequence_index(self, alignment_index):
         """Where can a given alignment index be found in the sequence?
@@ -229,35 +337,27 @@ class FastaEntry(object):
         the sequence then len(self.ungapped()) - 0.5 will be returned.
 
         """
-        if alignment_index > self.length():
-            raise IndexError("alignment index out of range")
-        s = self.sequence[:alignment_index]
-        nSequenceIndex = float(alignment_index)
-        for sGap in GAP_CHARACTERS:
-            nSequenceIndex -= s.count(sGap)
+        alignment_index = self._check_alignment_index(alignment_index)
+        index = float(bisect_left(self.residue_positions(), alignment_index))
         if self.sequence[alignment_index] in GAP_CHARACTERS:
-            nSequenceIndex -= 0.5
-        return nSequenceIndex
+            index -= 0.5
+        return index
+
+    def sequence_indexes(self, alignment_indexes):
+        """.sequence_index() for each of the given alignment indexes, as a list."""
+        return [self.sequence_index(i) for i in alignment_indexes]
 
     def starts_before(self, alignment_index):
         """Is the first non-gap char located before (or at) this index?"""
-        if alignment_index > self.length():
-            raise IndexError("alignment index out of range")
-        alignment_index %= self.length()
-        for s in self.sequence[:alignment_index + 1]:
-            if s not in GAP_CHARACTERS:
-                return True
-        return False
+        alignment_index = self._check_alignment_index(alignment_index)
+        positions = self.residue_positions()
+        return bool(positions) and positions[0] <= alignment_index
 
     def ends_after(self, alignment_index):
         """Is the last non-gap char located after (or at) this index?"""
-        if alignment_index > self.length():
-            raise IndexError("alignment index out of range")
-        alignment_index %= self.length()
-        for s in self.sequence[alignment_index:]:
-            if s not in GAP_CHARACTERS:
-                return True
-        return False
+        alignment_index = self._check_alignment_index(alignment_index)
+        positions = self.residue_positions()
+        return bool(positions) and positions[-1] >= alignment_index
 
     def in_sequence(self, alignment_index):
         """Does the sequence start before and end after this index?"""
@@ -271,30 +371,209 @@ def parse_sequence(sequence):
     """Parse a string or file and return a FastaEntry. Convenience for FastaEntry.from_text()."""
     return FastaEntry.from_text(sequence)
 
+def parse_entry_text(text):
+    """Parse the plaintext of a single entry, as given by iter_entry_texts().
+
+    Equivalent to FastaEntry.from_text(text) for text that starts with a
+    header, but does only one pass over the text.
+    """
+    newline = text.find('\n')
+    if newline < 0:
+        header, body = text, ''
+    else:
+        header, body = text[:newline], text[newline + 1:]
+    parts = header.split(None, 1)
+    entry = FastaEntry(parts[0][1:])
+    if len(parts) > 1:
+        entry.description = parts[1].strip()
+    if ';' in body:
+        body = '\n'.join(line for line in body.split('\n') if not line.lstrip().startswith(';'))
+    entry.sequence = ''.join(body.split())
+    return entry
+
+READ_SIZE = 1024 * 1024
+
+def iter_chunks(fasta, size=READ_SIZE):
+    """Iterate over the text of a str, file or iterable of lines in large chunks."""
+    if isinstance(fasta, basestring):
+        yield fasta
+    elif hasattr(fasta, 'read'):
+        while True:
+            chunk = fasta.read(size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in fasta:
+            yield chunk
+
+def iter_entry_texts(fasta, size=READ_SIZE):
+    """An iterator for the plaintext of each entry in a str or file.
+
+    Reads size chars at a time and looks for headers, i.e. lines starting
+    with '>', with .find(), so each char is only looked at once. Yields
+    nothing for empty input.
+    """
+    started = False
+    pending = []
+    newline_before = False
+    for chunk in iter_chunks(fasta, size):
+        if not chunk:
+            continue
+        if not started:
+            if chunk[0] != '>':
+                raise FormatError('junk data before first sequence header')
+            started = True
+        start = 0
+        if pending and newline_before and chunk[0] == '>':
+            yield ''.join(pending)
+            pending = []
+        while True:
+            header = chunk.find('\n>', start)
+            if header < 0:
+                break
+            pending.append(chunk[start:header + 1])
+            yield ''.join(pending)
+            pending = []
+            start = header + 1
+        pending.append(chunk[start:])
+        newline_before = chunk[-1] == '\n'
+    if pending:
+        yield ''.join(pending)
+
+def count_entries(fasta):
+    """Return the number of entries iter_entries() would find in a fasta str or file.
+
+    Raises FormatError like iter_entries(), but returns 0 for empty input.
+    """
+    if isinstance(fasta, basestring):
+        if not fasta:
+            return 0
+        if fasta[0] != '>':
+            raise FormatError('junk data before first sequence header')
+        return fasta.count('\n>') + 1
+    count = 0
+    newline_before = None
+    for chunk in iter_chunks(fasta):
+        if not chunk:
+            continue
+        if newline_before is None:
+            count = count_entries(chunk)
+        else:
+            count += chunk.count('\n>') + (newline_before and chunk[0] == '>')
+        newline_before = chunk[-1] == '\n'
+    return count
+
 def iter_entries(fasta, plaintext=False):
     """An iterator for FastaEntry objects.
 
     The fasta can be given either as a str or as a file. Set plaintext=True
     to return plaintext entries rather than parsed ones.
 
+    Raises FormatError for data before the first header, and EmptyInput
+    for empty input (or yields a single '' if plaintext=True).
+
     """
-    if isinstance(fasta, basestring):
-        fasta = StringIO(fasta)
-    lines = []
-    build_entry = lambda lines: ''.join(lines) if plaintext else parse_sequence(lines)
-    entries = 0
-    for sLine in fasta:
-        if sLine.startswith('>'):
-            entries += 1
-            if lines:
-                yield build_entry(lines)
-                lines = []
-        elif not lines:
-            if not entries:
-                raise FormatError('junk data before first sequence header')
-            raise FormatError
-        lines.append(sLine)
-    yield build_entry(lines)
+    empty = True
+    for text in iter_entry_texts(fasta):
+        empty = False
+        yield text if plaintext else parse_entry_text(text)
+    if empty:
+        if not plaintext:
+            raise EmptyInput
+        yield ''
+
+PARALLEL_MIN_SIZE = 64 * 1024 * 1024
+
+def split_ranges(data, n):
+    """Split fasta text into at most n (start, stop) ranges of whole entries.
+
+    data may be a str or an mmap. The ranges are roughly equally long.
+    """
+    size = len(data)
+    starts = [0]
+    for i in range(1, n):
+        header = data.find('\n>', max(size * i // n, starts[-1]))
+        if header < 0:
+            break
+        starts.append(header + 1)
+    return zip(starts, starts[1:] + [size])
+
+def parse_range(args):
+    """Parse the entries in a byte range of a fasta file, for parse_path() workers.
+
+    args is a (path, start, stop, lengths_only) tuple. Returns a list of
+    FastaEntry objects, or of (id, length) tuples if lengths_only is set.
+    """
+    path, start, stop, lengths_only = args
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            chunks = (data[i:min(i + READ_SIZE, stop)] for i in xrange(start, stop, READ_SIZE))
+            entries = (parse_entry_text(text) for text in iter_entry_texts(chunks))
+            if lengths_only:
+                return [(entry.id, len(entry)) for entry in entries]
+            return list(entries)
+        finally:
+            data.close()
+
+def get_cpu_count():
+    """The number of cpus allotted by slurm, or else all cpus on this machine.
+
+    Inside a slurm job without a cpu count in its environment this is 1, so
+    that jobs on shared nodes only use the cpus they asked for.
+    """
+    for name in 'SLURM_CPUS_PER_TASK', 'SLURM_CPUS_ON_NODE', 'SLURM_JOB_CPUS_PER_NODE':
+        # SLURM_JOB_CPUS_PER_NODE looks like "4(x2)" for several nodes.
+        count = re.match(r'\d*', os.environ.get(name, '')).group()
+        if count:
+            return int(count)
+    if 'SLURM_JOB_ID' in os.environ:
+        return 1
+    return multiprocessing.cpu_count()
+
+def parse_path(path, lengths_only=False, processes=None, min_size=PARALLEL_MIN_SIZE):
+    """Iterate over the entries in the fasta file path, using all cpus for big files.
+
+    Files of at least min_size bytes are split in ranges of whole entries,
+    which are parsed in a pool of processes (default: get_cpu_count()) and
+    yielded in file order. Set lengths_only=True to get (id, length) tuples
+    instead of FastaEntry objects, which is far cheaper for the workers to
+    send back.
+
+    Raises FormatError like iter_entries(), but yields nothing for empty files.
+    """
+    size = os.path.getsize(path)
+    if not size:
+        return
+    if size < min_size:
+        for entry in parse_range((path, 0, size, lengths_only)):
+            yield entry
+        return
+    with open(path, 'rb') as f:
+        if f.read(1) != '>':
+            raise FormatError('junk data before first sequence header')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        processes = processes or get_cpu_count()
+        # More ranges than processes, to even out the load.
+        ranges = [(path, start, stop, lengths_only) for start, stop in split_ranges(data, processes * 4)]
+        data.close()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for entry in chain.from_iterable(pool.imap(parse_range, ranges)):
+            yield entry
+    finally:
+        pool.terminate()
+
+def search_motif(entries, regex):
+    """Find all matches of regex in the ungapped sequences of entries.
+
+    Returns a list of (entry, start, stop) tuples, where start and stop are
+    alignment indexes. See FastaEntry.iter_motif().
+    """
+    if isinstance(regex, str):
+        regex = compile_regex(regex)
+    return [(entry, start, stop) for entry in entries for start, stop in entry.iter_motif(regex)]
 
 class FastaList(list):
     """A standard list, but with .from_text() and .to_str() methods."""
@@ -315,6 +594,63 @@ class FastaList(list):
         """Return all entries in plaintext as a single str."""
         return '\n'.join(str(entry) for entry in self)
 
+    def write_to(self, f):
+        """Write all entries in plaintext to the file f, a line at a time."""
+        for entry in self:
+            entry.write_to(f)
+
+    def count_residues(self):
+        return sum(len(entry) for entry in self)
+
+    def search_motif(self, regex):
+        """All matches of regex in all entries, see search_motif()."""
+        return search_motif(self, regex)
+
+    def split(self, n):
+        """Split into n FastaLists of consecutive entries, as equally sized as possible."""
+        size, extra = divmod(len(self), n)
+        chunks = []
+        start = 0
+        for i in range(n):
+            stop = start + size + (1 if i < extra else 0)
+            chunks.append(self.__class__(self[start:stop]))
+            start = stop
+        return chunks
+
+class FastaFile(object):
+    """A fasta file with a known number of entries and residues.
+
+    Stands in for a FastaList of the entries in the file when they are too
+    many to keep in memory, e.g: for large validated uploads.
+    """
+    def __init__(self, path, sequences, residues):
+        self.path = path
+        self.sequences = sequences
+        self.residues = residues
+
+    def __len__(self):
+        return self.sequences
+
+    def __iter__(self):
+        with open(self.path) as f:
+            for entry in iter_entries(f):
+                yield entry
+
+    def count_residues(self):
+        return self.residues
+
+    def iter_splits(self, n):
+        """Iterate over the plaintext entries of n consecutive parts of the file, sized as by FastaList.split().
+
+        Each part must be consumed before the next one is taken. The file is
+        closed after the last part.
+        """
+        size, extra = divmod(self.sequences, n)
+        with open(self.path) as f:
+            texts = iter_entry_texts(f)
+            for i in range(n):
+                yield islice(texts, size + (1 if i < extra else 0))
+
 class FastaDict(dict):
     """A standard dict, but with .from_text() and .to_str() methods."""
     @classmethod
@@ -342,6 +678,15 @@ class FastaDict(dict):
         """Return all entries in plaintext as a single str."""
         return '\n'.join(str(entry) for entry in self.values())
 
+    def write_to(self, f):
+        """Write all entries in plaintext to the file f, a line at a time."""
+        for entry in self.values():
+            entry.write_to(f)
+
+    def search_motif(self, regex):
+        """All matches of regex in all entries, see search_motif()."""
+        return search_motif(self.values(), regex)
+
 def entries(fasta, plaintext=False):
     """Parse a fasta string or file and return a FastaList of FastaEntry objects.
 
@@ -358,3 +703,304 @@ def fastadict(fasta, plaintext=False):
     Requires all sequence ids to be unique, or will raise NonUniqueIDError.
     """
     d = FastaDict.from_text(fasta, plaintext)
+
+INDEX_SUFFIX = '.fxi'
+
+def get_line_layout(body, length):
+    """Return (line_bases, line_width) for the sequence lines in body.
+
+    line_bases is the number of residues per line and line_width the number
+    of bytes per line including the newline. (0, 0) is returned unless all
+    lines but the last are equally long, so that the position of a residue
+    in the file cannot be computed.
+    """
+    lines = body.split('\n')
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if not lines:
+        return (0, 0)
+    line_bases = len(lines[0].rstrip('\r'))
+    line_width = len(lines[0]) + 1
+    if not line_bases or len(lines[-1]) >= line_width:
+        return (0, 0)
+    for line in lines[1:-1]:
+        if len(line) + 1 != line_width:
+            return (0, 0)
+    if (len(lines) - 1) * line_bases + len(lines[-1].rstrip('\r')) != length:
+        return (0, 0)
+    return (line_bases, line_width)
+
+def iter_index_records(fasta):
+    """Index the entries in a fasta file opened in binary mode.
+
+    Yields (id, length, offset, header_size, size, line_bases, line_width)
+    tuples, where offset is the byte offset of the header line in the file,
+    size the number of bytes in the entry including the header and length
+    the number of residues. See get_line_layout() for line_bases and
+    line_width.
+    """
+    offset = 0
+    for text in iter_entry_texts(fasta):
+        entry = parse_entry_text(text)
+        header_size = text.find('\n') + 1 or len(text)
+        line_bases, line_width = get_line_layout(text[header_size:], len(entry))
+        yield (entry.id, len(entry), offset, header_size, len(text), line_bases, line_width)
+        offset += len(text)
+
+def write_index(path):
+    """Index the fasta file path and save the index next to it, in path + INDEX_SUFFIX.
+
+    The index is a tab separated file with one line for each entry, with
+    the columns from iter_index_records().
+    """
+    index_path = path + INDEX_SUFFIX
+    tmp_path = index_path + '.tmp'
+    with open(path, 'rb') as fasta, open(tmp_path, 'w') as f:
+        for record in iter_index_records(fasta):
+            f.write('\t'.join(str(field) for field in record) + '\n')
+    os.rename(tmp_path, index_path)
+
+def read_index(path):
+    """Return an id: (length, offset, header_size, size, line_bases, line_width) dict for the fasta file path.
+
+    The index saved by write_index() is used if it is newer than the fasta
+    file. Otherwise the fasta file is indexed in memory. The first entry is
+    used for duplicated ids.
+    """
+    index_path = path + INDEX_SUFFIX
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        with open(index_path) as f:
+            return make_index(line.rstrip('\n').split('\t') for line in f)
+    with open(path, 'rb') as f:
+        return make_index(iter_index_records(f))
+
+def make_index(records):
+    """The read_index() dict of records, from iter_index_records() or an index file."""
+    index = dict()
+    for record in records:
+        index.setdefault(record[0], tuple(int(field) for field in record[1:]))
+    return index
+
+class IndexedFasta(object):
+    """Random access by id to the entries of a fasta file.
+
+    Each entry is fetched with a single seek and read, or a slice of the
+    file mapped into memory if use_mmap=True, so looking up n entries costs
+    O(n) rather than O(size of file) once the index is loaded. See
+    read_index().
+    """
+    def __init__(self, path, use_mmap=False):
+        self.path = path
+        self.index = read_index(path)
+        self.file = open(path, 'rb')
+        self.data = None
+        if use_mmap and os.path.getsize(path):
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, id):
+        length, offset, header_size, size, line_bases, line_width = self.index[id]
+        return parse_entry_text(self.read(offset, size))
+
+    def get(self, id, default=None):
+        if id in self.index:
+            return self[id]
+        return default
+
+    def read(self, offset, size):
+        if self.data is not None:
+            return self.data[offset:offset + size]
+        self.file.seek(offset)
+        return self.file.read(size)
+
+    def get_sequence(self, id, start=0, stop=None):
+        """Return residues start to stop (python slice notation) of the entry with the given id.
+
+        Only the requested residues are read if all sequence lines in the
+        entry have the same length.
+        """
+        length, offset, header_size, size, line_bases, line_width = self.index[id]
+        start, stop, step = slice(start, stop).indices(length)
+        if not line_bases:
+            return self[id].sequence[start:stop]
+        if start >= stop:
+            return ''
+        def get_position(i):
+            return offset + header_size + (i // line_bases) * line_width + i % line_bases
+        first = get_position(start)
+        return ''.join(self.read(first, get_position(stop - 1) + 1 - first).split())
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+CACHE_SUFFIX = '.fxb'
+CACHE_MAGIC = 'AGDAFXB\n'
+CACHE_VERSION = 1
+# magic, version, number of entries, size and mtime of the fasta file, and
+# the sizes of the residue, id and description blobs.
+CACHE_HEADER = struct.Struct('<8sIIQdQQQ')
+CACHE_OFFSET = struct.Struct('<Q')
+CACHE_RANGE = struct.Struct('<QQ')
+
+def get_source_stamp(path):
+    """Return (size, mtime) of the fasta file path, which a binary cache must match."""
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+def write_cache(path):
+    """Parse the fasta file path and save it in binary form next to it, in path + CACHE_SUFFIX.
+
+    The cache starts with a CACHE_HEADER and is followed by the concatenated
+    residues, ids and descriptions of all entries, and then three tables of
+    entries + 1 offsets into these, as little endian 64 bit integers. Entry
+    i spans offsets[i]:offsets[i + 1] of each blob. See FastaCache.
+    """
+    cache_path = path + CACHE_SUFFIX
+    tmp_path = cache_path + '.tmp'
+    size, mtime = get_source_stamp(path)
+    ids = []
+    descriptions = []
+    tables = ([0], [0], [0])
+    with open(tmp_path, 'wb') as f:
+        f.write('\0' * CACHE_HEADER.size)
+        for entry in parse_path(path):
+            f.write(entry.sequence)
+            ids.append(entry.id)
+            descriptions.append(entry.description)
+            for table, blob in zip(tables, (entry.sequence, entry.id, entry.description)):
+                table.append(table[-1] + len(blob))
+        f.write(''.join(ids))
+        f.write(''.join(descriptions))
+        for table in tables:
+            f.write(struct.pack('<%dQ' % len(table), *table))
+        f.seek(0)
+        f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(ids), size, mtime,
+                                  *(table[-1] for table in tables)))
+    os.rename(tmp_path, cache_path)
+
+def read_cache_header(path):
+    """Return the header fields of the binary cache of the fasta file path.
+
+    Raises StaleCacheError unless the cache exists, has the current
+    CACHE_VERSION and was written from the current version of the file.
+    """
+    try:
+        with open(path + CACHE_SUFFIX, 'rb') as f:
+            header = CACHE_HEADER.unpack(f.read(CACHE_HEADER.size))
+        stamp = get_source_stamp(path)
+    except (IOError, OSError, struct.error):
+        raise StaleCacheError()
+    if header[:2] != (CACHE_MAGIC, CACHE_VERSION) or header[3:5] != stamp:
+        raise StaleCacheError()
+    return header
+
+class FastaCache(object):
+    """The entries of a fasta file, read from its binary cache.
+
+    Has the same interface as IndexedFasta. The cache is mapped into memory,
+    so opening it costs no parsing and its pages are shared by all processes
+    that read it. Raises StaleCacheError if the cache is not up to date, see
+    write_cache().
+    """
+    def __init__(self, path):
+        self.path = path
+        magic, version, self.count, size, mtime, residues, ids, descriptions = read_cache_header(path)
+        self.file = open(path + CACHE_SUFFIX, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.residues = CACHE_HEADER.size
+        self.ids = self.residues + residues
+        self.descriptions = self.ids + ids
+        table = self.descriptions + descriptions
+        step = (self.count + 1) * CACHE_OFFSET.size
+        self.residue_offsets, self.id_offsets, self.description_offsets = (table, table + step, table + 2 * step)
+        self._index = None
+
+    def get_range(self, table, i):
+        return CACHE_RANGE.unpack_from(self.data, table + i * CACHE_OFFSET.size)
+
+    def get_field(self, blob, table, i):
+        start, stop = self.get_range(table, i)
+        return self.data[blob + start:blob + stop]
+
+    @property
+    def index(self):
+        """An id: entry number dict, built on first use. The first entry is used for duplicated ids."""
+        if self._index is None:
+            index = dict()
+            for i in xrange(self.count - 1, -1, -1):
+                index[self.get_field(self.ids, self.id_offsets, i)] = i
+            self._index = index
+        return self._index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, id):
+        return self.get_entry(self.index[id])
+
+    def get(self, id, default=None):
+        if id in self.index:
+            return self[id]
+        return default
+
+    def get_entry(self, i):
+        """Return entry number i, in file order."""
+        return FastaEntry(self.get_field(self.ids, self.id_offsets, i),
+                          self.get_field(self.descriptions, self.description_offsets, i),
+                          self.get_field(self.residues, self.residue_offsets, i))
+
+    def iter_entries(self):
+        """Iterate over all entries in file order, including duplicates."""
+        for i in xrange(self.count):
+            yield self.get_entry(i)
+
+    def iter_lengths(self):
+        """Iterate over (id, length) for all entries in file order, like parse_path(lengths_only=True)."""
+        for i in xrange(self.count):
+            start, stop = self.get_range(self.residue_offsets, i)
+            yield (self.get_field(self.ids, self.id_offsets, i), stop - start)
+
+    def get_sequence(self, id, start=0, stop=None):
+        """Return residues start to stop (python slice notation) of the entry with the given id."""
+        first, last = self.get_range(self.residue_offsets, self.index[id])
+        start, stop, step = slice(start, stop).indices(last - first)
+        return self.data[self.residues + first + start:self.residues + first + max(start, stop)]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+def open_fasta(path, use_mmap=False):
+    """Return a FastaCache for path if its binary cache is up to date, or else an IndexedFasta."""
+    try:
+        return FastaCache(path)
+    except StaleCacheError:
+        return IndexedFasta(path, use_mmap)
+
+if __name__ == '__main__':
+    # Usage: python fasta.py [--binary] FASTA_FILE...
+    # Saves an index next to each fasta file, see write_index(), or with
+    # --binary a binary cache of the parsed entries, see write_cache().
+    paths = sys.argv[1:]
+    write = write_index
+    if paths and paths[0] == '--binary':
+        paths = paths[1:]
+        write = write_cache
+    for path in paths:
+        write(path)
@@ -0,0 +1,166 @@
+import cPickle
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.test import SimpleTestCase
+
+from core import fasta
+
+
+class TestIterEntries(SimpleTestCase):
+    text = ('>a first entry\n'
+            'ACDE\n'
+            '; a comment\n'
+            'FG HI\n'
+            '>b\n'
+            '>c\n'
+            'KL\n')
+
+    def parse(self, fasta_input, plaintext=False):
+        return list(fasta.iter_entries(fasta_input, plaintext))
+
+    def test_entries(self):
+        entries = self.parse(self.text)
+        self.assertEquals([(e.id, e.description, e.sequence) for e in entries],
+                          [('a', 'first entry', 'ACDEFGHI'), ('b', '', ''), ('c', '', 'KL')])
+
+    def test_headers_split_between_reads(self):
+        for size in range(1, 10):
+            texts = list(fasta.iter_entry_texts(StringIO(self.text), size))
+            self.assertEquals(texts, self.parse(self.text, plaintext=True))
+            self.assertEquals(''.join(texts), self.text)
+
+    def test_errors(self):
+        self.assertRaises(fasta.FormatError, self.parse, 'ACDE\n>a\nACDE\n')
+        self.assertRaises(fasta.FormatError, self.parse, '\n>a\nACDE\n')
+        self.assertRaises(fasta.EmptyInput, self.parse, '')
+        self.assertEquals(self.parse('', plaintext=True), [''])
+
+    def test_count_entries(self):
+        self.assertEquals(fasta.count_entries(self.text), len(self.parse(self.text)))
+        self.assertEquals(fasta.count_entries(''), 0)
+        self.assertRaises(fasta.FormatError, fasta.count_entries, 'ACDE\n>a\n')
+        for size in range(1, 10):
+            self.assertEquals(fasta.count_entries(fasta.iter_chunks(StringIO(self.text), size)), 3)
+
+    def test_parse_path(self):
+        tmp = tempfile.NamedTemporaryFile()
+        tmp.write(self.text * 5)
+        tmp.flush()
+        entries = [(e.id, e.sequence) for e in self.parse(self.text * 5)]
+        for processes in (1, 2, 4):
+            parsed = fasta.parse_path(tmp.name, processes=processes, min_size=0)
+            self.assertEquals([(e.id, e.sequence) for e in parsed], entries)
+        lengths = fasta.parse_path(tmp.name, lengths_only=True, processes=2, min_size=0)
+        self.assertEquals(list(lengths), [(id, len(sequence)) for id, sequence in entries])
+
+    def test_cpu_count(self):
+        names = ['SLURM_JOB_ID', 'SLURM_CPUS_PER_TASK', 'SLURM_CPUS_ON_NODE', 'SLURM_JOB_CPUS_PER_NODE']
+        saved = dict((name, os.environ.pop(name)) for name in names if name in os.environ)
+        self.addCleanup(os.environ.update, saved)
+        for name in names:
+            self.addCleanup(os.environ.pop, name, None)
+        self.assertEquals(fasta.get_cpu_count(), fasta.multiprocessing.cpu_count())
+        os.environ['SLURM_JOB_ID'] = '17'
+        self.assertEquals(fasta.get_cpu_count(), 1)
+        os.environ['SLURM_JOB_CPUS_PER_NODE'] = '4(x2)'
+        self.assertEquals(fasta.get_cpu_count(), 4)
+        os.environ['SLURM_CPUS_ON_NODE'] = '3'
+        self.assertEquals(fasta.get_cpu_count(), 3)
+        os.environ['SLURM_CPUS_PER_TASK'] = '2'
+        self.assertEquals(fasta.get_cpu_count(), 2)
+
+    def test_fasta_file_splits(self):
+        tmp = tempfile.NamedTemporaryFile()
+        tmp.write(self.text)
+        tmp.flush()
+        fasta_file = fasta.FastaFile(tmp.name, 3, 10)
+        self.assertEquals([e.id for e in fasta_file], ['a', 'b', 'c'])
+        splits = [''.join(texts) for texts in fasta_file.iter_splits(2)]
+        self.assertEquals([[e.id for e in fasta.entries(text)] for text in splits], [['a', 'b'], ['c']])
+
+
+class TestFastaEntry(SimpleTestCase):
+    def test_entry(self):
+        entry = fasta.FastaEntry('a', 'desc', 'ACDEFG', line_length=4)
+        self.assertFalse(hasattr(entry, '__dict__'))
+        self.assertEquals((len(entry), entry[1:3], list(entry)[-1]), (6, 'CD', 'G'))
+        self.assertEquals(str(entry), '>a desc\nACDE\nFG')
+        out = StringIO()
+        fasta.FastaList([entry, entry]).write_to(out)
+        self.assertEquals(out.getvalue(), '>a desc\nACDE\nFG\n' * 2)
+        copy = cPickle.loads(cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL))
+        self.assertEquals(str(copy), str(entry))
+
+    def test_coordinates(self):
+        entry = fasta.FastaEntry('a', '', '--AC-.D-')
+        self.assertEquals(entry.alignment_indexes([0, 1, 2, -1]), [2, 3, 6, 6])
+        self.assertEquals(entry.sequence_indexes(range(8)), [-0.5, -0.5, 0, 1, 1.5, 1.5, 2, 2.5])
+        self.assertEquals([entry.in_sequence(i) for i in range(8)],
+                          [False, False, True, True, True, True, True, False])
+        self.assertTrue(entry.present_in_slice(2, 7))
+        self.assertRaises(IndexError, entry.alignment_index, 3)
+        self.assertRaises(IndexError, entry.sequence_index, 8)
+        entry.sequence = 'A-C'
+        self.assertEquals(entry.alignment_index(1), 2)
+
+    def test_motif_search(self):
+        entries = fasta.FastaList([fasta.FastaEntry('a', '', 'A-cg.AC'), fasta.FastaEntry('b', '', 'GGG')])
+        self.assertEquals(entries[0].search_aligned('ACG').span(), (0, 4))
+        self.assertEquals([(e.id, start, stop) for e, start, stop in entries.search_motif('AC')],
+                          [('a', 0, 3), ('a', 5, 7)])
+        self.assertEquals(entries.search_motif('W'), [])
+        self.assertTrue(fasta.compile_regex('AC') is fasta.compile_regex('AC'))
+
+
+class TestIndexedFasta(SimpleTestCase):
+    text = ('>a first entry\n'
+            'ACDEF\n'
+            'GHIKL\n'
+            'MN\n'
+            '>b\n'
+            'AC\n'
+            'DEF\n'
+            '>a duplicate\n'
+            'W\n')
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'db.fa')
+        open(self.path, 'w').write(self.text)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, db):
+        self.assertEquals(sorted(db), ['a', 'b'])
+        self.assertEquals(db['a'].description, 'first entry')
+        self.assertEquals(db['a'].sequence, 'ACDEFGHIKLMN')
+        self.assertEquals(db.get_sequence('a', 3, 11), 'EFGHIKLM')
+        self.assertEquals(db.get_sequence('a', -2), 'MN')
+        self.assertEquals(db.get_sequence('b', 1, 4), 'CDE')
+        self.assertEquals(db.get('c'), None)
+        db.close()
+
+    def test_in_memory_index(self):
+        self.check(fasta.IndexedFasta(self.path))
+
+    def test_saved_index(self):
+        fasta.write_index(self.path)
+        self.assertTrue(os.path.exists(self.path + fasta.INDEX_SUFFIX))
+        self.check(fasta.IndexedFasta(self.path, use_mmap=True))
+
+    def test_binary_cache(self):
+        self.assertRaises(fasta.StaleCacheError, fasta.FastaCache, self.path)
+        self.assertTrue(isinstance(fasta.open_fasta(self.path), fasta.IndexedFasta))
+        fasta.write_cache(self.path)
+        db = fasta.open_fasta(self.path)
+        self.assertTrue(isinstance(db, fasta.FastaCache))
+        self.assertEquals([(e.id, e.sequence) for e in db.iter_entries()],
+                          [('a', 'ACDEFGHIKLMN'), ('b', 'ACDEF'), ('a', 'W')])
+        self.assertEquals(list(db.iter_lengths()), [('a', 12), ('b', 5), ('a', 1)])
+        self.check(db)
+        open(self.path, 'a').write('>c\nW\n')
+        self.assertRaises(fasta.StaleCacheError, fasta.FastaCache, self.path)
@@ -1,3 +1,4 @@
+import json
 import shutil
 
 from django.template.loader import render_to_string
@@ -33,9 +34,11 @@ class DatiscaNoduleBlastJob(Job):
                  blast='results.blast',
                  json='noduleblast.json',
                  hits='hits.fa')
+    # Cpus per job array task, one per blast thread.
+    cpus = 8
 
     def on_submit(self, program, entries, db, evalue):
-        self.statistics = dict(sequences=len(entries), characters=sum(len(e) for e in entries))
+        self.statistics = dict(sequences=len(entries), characters=entries.count_residues())
         dbnick = 'reads'
         if db.endswith('all'):
             dbnick = 'reads'
@@ -45,13 +48,16 @@ class DatiscaNoduleBlastJob(Job):
             dbnick = 'assembly'
         self.parameters = dict(program=program, db=dbnick, evalue=evalue)
         self.result_files = self.files
-        self.write_workfile('query', entries.to_str())
+        self.write_sharded_workfile('query', entries)
         script = 'blast.sh'
         params = dict(db=db,
                       evalue=evalue,
-                      out=self.files['blast'],
+                      out=self.task_name('blast'),
+                      json=self.task_name('json'),
+                      hits=self.task_name('hits'),
                       program=program,
-                      query=self.files['query'])
+                      cpus=self.cpus,
+                      query=self.task_name('query'))
         self.write_workfile(script, render_to_string('datisca/blast.sh', params))
         shutil.copy(parse_blast.__file__.rstrip('oc'), self.workdir)
 
@@ -61,4 +67,21 @@ class DatiscaNoduleBlastJob(Job):
         self.write_workfile('core/__init__.py', "")
 
         self.result_files = self.files
-        slurm.submit(self, self.workfile(script))
+        slurm.submit(self, self.workfile(script), cpus=self.cpus, array=self.array_size)
+
+    def merge_shards(self):
+        self.concatenate_shards('blast')
+        queries = []
+        for shard in self.open_shards('json'):
+            info = json.load(shard)
+            queries.extend(info['results']['queries'])
+        info['results']['queries'] = queries
+        self.write_workfile('json', json.dumps(info))
+        # The same sequence may be hit in several shards.
+        seen = set()
+        with open(self.workfile('hits'), 'w') as hits:
+            for shard in self.open_shards('hits'):
+                for entry in fasta.entries(shard):
+                    if entry.id not in seen:
+                        seen.add(entry.id)
+                        entry.write_to(hits)
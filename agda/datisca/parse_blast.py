@@ -1,4 +1,3 @@
-from itertools import chain
 import json
 import os
 import sys
@@ -35,7 +34,10 @@ def parse_blast(blast_output, query_file):
     if isinstance(blast_output, basestring):
         blast_output = blast_output.splitlines(True)
     blast_output = iter(blast_output)
-    query_lengths = dict((q.id, len(q)) for q in fasta.entries(query_file))
+    if isinstance(query_file, basestring):
+        query_lengths = dict(fasta.parse_path(query_file, lengths_only=True))
+    else:
+        query_lengths = dict((q.id, len(q)) for q in fasta.entries(query_file))
     results = dict(program=get_program(blast_output),
                    database=get_database(blast_output))
     queries = []
@@ -101,24 +103,25 @@ def get_hit_ids(results):
     return ids
 
 
-def filter_sequences(db, ids):
-    for entry in fasta.iter_entries(db):
-        if entry.id in ids:
-            yield entry
-            ids.remove(entry.id)
-            if not ids:
-                return
+def filter_sequences(dbs, ids):
+    """Fetch the entries with the given ids from the dbs, in order."""
+    ids = set(ids)
+    for db in dbs:
+        for id in list(ids):
+            if id in db:
+                yield db[id]
+                ids.remove(id)
     if ids:
         raise RuntimeError('not all sequences were found: ' + str(list(ids)))
 
 
-def save_hit_fasta(hit_file, db, results):
+def save_hit_fasta(hit_file, dbs, results):
     ids = get_hit_ids(results)
     entries = fasta.FastaDict()
-    for entry in filter_sequences(db, set(ids)):
+    for entry in filter_sequences(dbs, ids):
         entries[entry.id] = entry
     for id in ids:
-        print >> hit_file, entries[id]
+        entries[id].write_to(hit_file)
 
 
 def get_dbfiles(dbdir, alias_file):
@@ -126,6 +129,14 @@ def get_dbfiles(dbdir, alias_file):
         if line.startswith('DBLIST'):
             return [os.path.join(dbdir, f) for f in line.split()[1:]]
 
+
+def open_dbs(db_file):
+    """Open db_file, or all files in the 'all' alias, with fasta.open_fasta()."""
+    dbdir, dbfile = os.path.split(db_file)
+    if dbfile == 'all':
+        return [fasta.open_fasta(f) for f in get_dbfiles(dbdir, dbfile + '.nal')]
+    return [fasta.open_fasta(db_file)]
+
 if __name__ == '__main__':
     db_file = sys.argv[1]
     query_file = sys.argv[2] if len(sys.argv) > 2 else 'query.fasta'
@@ -133,12 +144,7 @@ if __name__ == '__main__':
     results_file = sys.argv[4] if len(sys.argv) > 4 else 'noduleblast.json'
     hit_file = sys.argv[5] if len(sys.argv) > 5 else 'hits.fa'
 
-    results = parse_blast(open(blast_file), open(query_file))
+    results = parse_blast(open(blast_file), query_file)
     info = dict(format=json_format_version, results=results)
     json.dump(info, open(results_file, 'w'))
-    dbdir, dbfile = os.path.split(db_file)
-    if dbfile == 'all':
-        db = chain(*[open(f) for f in get_dbfiles(dbdir, dbfile + '.nal')])
-    else:
-        db = open(db_file)
-    save_hit_fasta(open(hit_file, 'w'), db, results)
+    save_hit_fasta(open(hit_file, 'w'), open_dbs(db_file), results)
@@ -21,10 +21,10 @@ else
 	prepare_db {{db}}.blastdb.tar.gz
 fi
 
-logg "Running {{program}} -num_threads 8 -query {{query}} -db $db -evalue {{evalue}} -max_target_seqs 250 -out {{out}}"
-{{program}} -num_threads 8 -query {{query}} -db $db -evalue {{evalue}} -max_target_seqs 250 -out {{out}}
+logg "Running {{program}} -num_threads {{cpus}} -query {{query}} -db $db -evalue {{evalue}} -max_target_seqs 250 -out {{out}}"
+{{program}} -num_threads {{cpus}} -query {{query}} -db $db -evalue {{evalue}} -max_target_seqs 250 -out {{out}}
 
 logg "Parsing hits..."
-python parse_blast.py {{db}}
+python parse_blast.py {{db}} {{query}} {{out}} {{json}} {{hits}}
 
 logg "Done."
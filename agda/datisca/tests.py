@@ -0,0 +1,44 @@
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from agda.forms.cached_uploads import CachedUpload
+from core import fasta
+from datisca.models import DatiscaNoduleBlastJob
+from jobs import models as job_models
+from jobs.models import QueuedSubmission
+
+
+class TestNoduleBlastSubmission(TestCase):
+    query = '>a\nACGT\n>b\nAC\n'
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.addCleanup(job_models.jobdirs.__setitem__, 'work', job_models.jobdirs['work'])
+        job_models.jobdirs['work'] = tmpdir
+        self.addCleanup(setattr, CachedUpload, 'dir', CachedUpload.dir)
+        CachedUpload.dir = tmpdir
+
+    def submit(self, **data):
+        data = dict(dict(name='Blast egg', program='blastn', db='contigs', evalue='10', query=''), **data)
+        response = self.client.post(reverse('datisca.views.nodule_trans_blast'), data)
+        self.assertEquals(response.status_code, 302)
+        job = DatiscaNoduleBlastJob.objects.get(name='Blast egg')
+        (program, entries, db, evalue), kw = QueuedSubmission.objects.get(job=job).arguments
+        return job, entries
+
+    def test_text_query(self):
+        job, entries = self.submit(query=self.query)
+        self.assertTrue(isinstance(entries, fasta.FastaList))
+        self.assertEquals(entries.to_str() + '\n', self.query)
+
+    def test_uploaded_query(self):
+        job, entries = self.submit(query_file=SimpleUploadedFile('query.fasta', self.query))
+        self.assertTrue(isinstance(entries, fasta.FastaFile))
+        self.assertEquals((len(entries), entries.count_residues()), (2, 6))
+        self.assertEquals(entries.path, job.workfile('query'))
+        self.assertEquals(open(entries.path).read(), self.query)
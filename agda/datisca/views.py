@@ -1,23 +1,22 @@
 import json
 import os
-import time
 
 from django import forms
 from django.conf import settings
-from django.http import Http404, HttpResponse
+from django.http import HttpResponse
 from django.shortcuts import redirect, render
 from django.utils.text import get_text_list
 from django.db import transaction
 
 from agda.forms import FastaCleaner, FormContents, get_form
 from agda.forms.cached_uploads import CachedUploadManager
+from core import fasta
 from agda.views import (json_response,
                         package_template_dict,)
 
 from jobs.views_api import api_show_results
 
 from jobs.models import (JOB_STATUS_LEVEL_ACCEPTED,
-                         JOB_STATUS_LEVEL_DELETED,
                          JOB_STATUS_LEVEL_FINISHED,
                          get_job_or_404)
 
@@ -81,15 +80,12 @@ class NoduleTransForm(forms.Form):
                       name='NoduleBlast example'),
         advanced=['name'])
 
-    clean_fasta = FastaCleaner(default_id='query_sequence', min_sequences=0).clean
-    _entries = None
-
+    fasta_cleaner = FastaCleaner(default_id='query_sequence', min_sequences=0)
     def clean_db(self):
         return db_files[self.cleaned_data['db']]
 
     def clean_query(self):
-        self._entries = self.clean_fasta(self.cleaned_data['query'])
-        return self._entries
+        return self.fasta_cleaner.clean(self.cleaned_data['query'])
 
     def clean_query_file(self):
         upload = self.cleaned_data['query_file']
@@ -98,7 +94,7 @@ class NoduleTransForm(forms.Form):
             # "keep".  Any initial data is already clean, so let cached_upload
             # sort these out.
             return upload
-        self._entries = self.clean_fasta(upload)
+        self.fasta_cleaner.clean_file(upload)
         upload.seek(0)
         return upload
 
@@ -112,12 +108,17 @@ class NoduleTransForm(forms.Form):
             self._errors.setdefault('query', []).append('At least one sequence is required.')
         return cleaned_data
 
-    def get_query_entries(self):
+    def get_query_entries(self, job):
+        """Return the query as a FastaList, or for uploads as a fasta.FastaFile
+        streamed straight to the query workfile of job.
+        """
         if not self.is_valid():
             raise KeyError('Cannot get entries from invalid form')
-        if self._entries is not None:
-            return self._entries
-        return self.clean_fasta(self.initial['query_file'].open())
+        if self.cleaned_data['query']:
+            return self.cleaned_data['query']
+        with job.open_workfile('query', 'w') as out:
+            sequences, residues = self.fasta_cleaner.clean_file(self.initial['query_file'].open(), out)
+        return fasta.FastaFile(job.workfile('query'), sequences, residues)
 
 
 def api_nodule_trans_blast(request):
@@ -140,13 +141,13 @@ def api_nodule_trans_blast(request):
     job = DatiscaNoduleBlastJob(status=JOB_STATUS_LEVEL_ACCEPTED)
     job.save()
     job.log_create(request.agda_api_user, 'Created in api.')
-    job.submit(request.agda_api_user,
-               request.META['REMOTE_ADDR'],
-               form.cleaned_data['name'],
-               form.cleaned_data['program'],
-               form.get_query_entries(),
-               form.cleaned_data['db'],
-               form.cleaned_data['evalue'])
+    job.enqueue(request.agda_api_user,
+                request.META['REMOTE_ADDR'],
+                form.cleaned_data['name'],
+                form.cleaned_data['program'],
+                form.get_query_entries(job),
+                form.cleaned_data['db'],
+                form.cleaned_data['evalue'])
     return redirect(api_show_results, job.slug)
 
 
@@ -164,13 +165,13 @@ def nodule_trans_blast(request):
     job.save()
     job = DatiscaNoduleBlastJob.objects.select_for_update().get(pk=job.id)
     job.log_create(request.user, 'Created in web interface.')
-    job.submit(request.user,
-               request.META['REMOTE_ADDR'],
-               form.cleaned_data['name'],
-               form.cleaned_data['program'],
-               form.get_query_entries(),
-               form.cleaned_data['db'],
-               form.cleaned_data['evalue'])
+    job.enqueue(request.user,
+                request.META['REMOTE_ADDR'],
+                form.cleaned_data['name'],
+                form.cleaned_data['program'],
+                form.get_query_entries(job),
+                form.cleaned_data['db'],
+                form.cleaned_data['evalue'])
     cached_uploads.clear_from_session()
     return redirect('jobs.views.show_results', job.slug)
 
@@ -187,12 +188,8 @@ def preprocess_nodule_blast(params):
                 region['graphic_width'] = region['length'] * scale_factor
 
 
-@transaction.atomic
 def nodule_trans_blast_results(request, slug):
-    job = get_job_or_404(slug=slug, select_for_update=True)
-    job.update_status(request.user)
-    if job.status == JOB_STATUS_LEVEL_DELETED:
-        raise Http404('no such job')
+    job = get_job_or_404(slug=slug)
     params = nodule_blast_params(request, job=job)
     if job.status == JOB_STATUS_LEVEL_FINISHED:
         data = json.load(open(job.resultfile('json')))
@@ -203,13 +200,4 @@ def nodule_trans_blast_results(request, slug):
             results = parse_blast.parse_blast(result_fh, query_fh)
         params['results'] = results
         preprocess_nodule_blast(params)
-    elif job.is_alive:
-        reload_time, interval = request.session.setdefault('datisca_nodule_trans_blast', dict()).pop(job.slug, (0, 5))
-        if reload_time <= time.time():
-            reload_time = max(time.time() + 5, reload_time + interval)
-            interval *= 2
-        request.session['datisca_nodule_trans_blast'][job.slug] = (reload_time, interval)
-        request.session.modified = True
-        params.update(timeout=reload_time - time.time())
-        params.update(reload_time=reload_time, interval=interval)
     return render(request, 'datisca/nodule_trans_blast_results.html', params)
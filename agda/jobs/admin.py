@@ -1,5 +1,6 @@
 from django.contrib import admin
-from jobs.models import Job
+from jobs.models import Job, QueuedSubmission
 
 # Job
 admin.site.register(Job)
+admin.site.register(QueuedSubmission)
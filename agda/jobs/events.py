@@ -0,0 +1,60 @@
+"""Job status change events.
+
+Job.update_status() and Job.submit() publish the new status of a job with
+publish_status() whenever it changes. Results pages then use the
+jobs.views.wait_for_status long-poll view to wait for the status to change
+instead of repeatedly reloading the page, and the view waits using
+wait_for_status_change(), which only looks in the cache.
+
+Statuses are published in settings.JOB_STATUS_EVENTS_CACHE, which must be
+shared by the web server and the job_status_daemon and job_submit_daemon
+processes, i.e. not a local memory cache. Every waiting client reads it, so
+use a cache that sets keys in constant time, like memcached, rather than the
+filesystem cache, which may cull entries on every set.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+def get_events_cache():
+    return get_cache(settings.JOB_STATUS_EVENTS_CACHE)
+
+
+def get_status_key(slug):
+    return 'jobs.status.' + slug
+
+
+def publish_status(job):
+    """Let anyone waiting for job know its current status."""
+    get_events_cache().set(get_status_key(job.slug), job.status, settings.JOB_STATUS_EVENTS_TTL)
+
+
+def wait_for_status_change(job, status, timeout, poll_interval):
+    """Wait until the status of job is no longer status.
+
+    job is as currently stored in the database, and status is the one the
+    client knows about. Polls the events cache every poll_interval seconds
+    for at most timeout seconds.
+
+    Returns
+    -------
+    The new status, or None if it did not change within timeout seconds.
+    """
+    if job.status != status:
+        return job.status
+    cache = get_events_cache()
+    key = get_status_key(job.slug)
+    # Nothing may have been published since the cache entry expired, so seed
+    # it with the status from the database. Statuses are only published after
+    # they are saved, so one that is already there is at least as new as job.
+    cache.add(key, job.status, settings.JOB_STATUS_EVENTS_TTL)
+    deadline = time.time() + timeout
+    while True:
+        current = cache.get(key)
+        if current is not None and current != status:
+            return current
+        if time.time() + poll_interval > deadline:
+            return None
+        time.sleep(poll_interval)
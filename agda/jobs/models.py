@@ -1,24 +1,34 @@
+import base64
+import cPickle
 from datetime import datetime
 import json
 import os
 import random
 import shutil
 import string
-import subprocess
 import sys
 import traceback
 import logging
 
 import pytz
 
-from django.db import (models,
+from django.db import (IntegrityError,
+                       models,
                        transaction)
+from django.db.models import Q
 from django.conf import settings
 from django.http import Http404
+from django.utils import timezone
 
 from agda.models import AgdaModelMixin
 from agda.utils import ModelDiffer
 from agda.settings.local import AUTH_USER_MODEL
+from core import fasta
+
+from jobs.events import publish_status
+from jobs.transports import (SchedulerBusy,
+                             get_array_job_id,
+                             get_slurm_transport)
 
 from model_utils.managers import InheritanceManager
 from profiles.models import get_user_or_anonymous
@@ -79,6 +89,8 @@ class Slurm(Scheduler):
         "PENDING":     JOB_STATUS_LEVEL_QUEUED,
         "CF":          JOB_STATUS_LEVEL_QUEUED,
         "CONFIGURING": JOB_STATUS_LEVEL_QUEUED,
+        "RQ":          JOB_STATUS_LEVEL_QUEUED,
+        "REQUEUED":    JOB_STATUS_LEVEL_QUEUED,
 
         "R":           JOB_STATUS_LEVEL_RUNNING,
         "RUNNING":     JOB_STATUS_LEVEL_RUNNING,
@@ -101,30 +113,62 @@ class Slurm(Scheduler):
         "PREEMPTED":   JOB_STATUS_LEVEL_FAILED,
         "TO":          JOB_STATUS_LEVEL_FAILED,
         "TIMEOUT":     JOB_STATUS_LEVEL_FAILED,
+        "BF":          JOB_STATUS_LEVEL_FAILED,
+        "BOOT_FAIL":   JOB_STATUS_LEVEL_FAILED,
+        "DL":          JOB_STATUS_LEVEL_FAILED,
+        "DEADLINE":    JOB_STATUS_LEVEL_FAILED,
+        "OOM":         JOB_STATUS_LEVEL_FAILED,
+        "OUT_OF_MEMORY": JOB_STATUS_LEVEL_FAILED,
     }
 
     time_format = "%Y-%m-%dT%H:%M:%S"
 
-    def submit(self, job, job_script, job_args=[], time=1440, nodes=1, tasks=1, slurm_args=[], stdin=None, stdout='std.out', stderr='std.err'):
+    def __init__(self, transport=None):
+        self._transport = transport
+
+    @property
+    def transport(self):
+        """The SlurmTransport used for all communication with slurm.
+
+        Defaults to the one configured in settings.SLURM_TRANSPORT.
+        """
+        if self._transport is None:
+            self._transport = get_slurm_transport(settings)
+        return self._transport
+
+    def submit(self, job, job_script, job_args=[], time=1440, nodes=1, tasks=1, cpus=1, slurm_args=[], stdin=None, stdout='std.out', stderr='std.err', array=0):
+        """Submit job_script to slurm.
+
+        Use array=n to submit a job array of n tasks, with task ids 0 to n-1.
+        The tasks write stdout and stderr to separate files, e.g: std-7.out
+        for task 7. The job array is tracked as one job, see merge_states().
+        cpus is the number of cpus per task, which core.fasta.get_cpu_count()
+        reports to the job.
+        """
+        if array:
+            stdout = job.shard_name(stdout, '%a')
+            stderr = job.shard_name(stderr, '%a')
         stdout = os.path.join(job.workdir, stdout)
         if not stdout.startswith(job.workdir):
             raise ValueError('job stdout file is not in job workdir')
         stderr = os.path.join(job.workdir, stderr)
-        if not stdout.startswith(job.workdir):
+        if not stderr.startswith(job.workdir):
             raise ValueError('job stderr file is not in job workdir')
-        argv = ['sbatch', '-D', job.workdir, '-o', stdout, '-e', stderr,
-                '-N', str(nodes), '-n', str(tasks), '-t', str(time)]
         if stdin is not None:
             stdin = os.path.join(job.workdir, stdin)
-            if not input.startswith(job.workdir):
+            if not stdin.startswith(job.workdir):
                 raise ValueError('job stdin file is not in job workdir')
-            argv.extend(['-i', stdin])
-        argv.extend(slurm_args)
-        argv.append(job_script)
-        argv.extend(job_args)
-        output = call(argv)
-        # sbatch should return e.g. "Submitted batch job 525112", fail if incomprehensible.
-        job.scheduler_id = str(int(output.split()[-1]))
+        options = dict(workdir=job.workdir,
+                       stdout=stdout,
+                       stderr=stderr,
+                       stdin=stdin,
+                       nodes=nodes,
+                       tasks=tasks,
+                       cpus=cpus,
+                       time=time)
+        if array:
+            options['array'] = '0-%s' % (array - 1)
+        job.scheduler_id = self.transport.submit(job_script, job_args, options, slurm_args)
         job.status = JOB_STATUS_LEVEL_SUBMITTED
         open(job.workfile('slurm-' + job.scheduler_id), 'w')
         logger.info('job id=%(id)s:%(slug)s submitted as slurm job %(scheduler_id)s.',
@@ -133,46 +177,79 @@ class Slurm(Scheduler):
     def cancel(self, job):
         if job.scheduler_id is not None:
             try:
-                call(['scancel', job.scheduler_id])
+                self.transport.cancel(job.scheduler_id)
             except:
                 pass
 
     def parse_status(self, slurm_state, slurm_start, slurm_end, slurm_id=None, jobmap=None):
+        """Return (status, start, end) for a job state reported by slurm.
+
+        Returns None, and logs a warning, for states that are not in
+        state_map or lack the start and end times they should have.
+        """
         start = None
         end = None
-        status = self.state_map[slurm_state.strip()]
         local_timezone = pytz.timezone("Europe/Stockholm")
-        if status >= JOB_STATUS_LEVEL_RUNNING:
-            start = datetime.strptime(slurm_start, self.time_format)
-            start = local_timezone.localize(start)
-        if status >= JOB_STATUS_LEVEL_FINISHED or status < 0:
-            end = datetime.strptime(slurm_end, self.time_format)
-            end = local_timezone.localize(end)
+        try:
+            status = self.state_map[slurm_state.strip()]
+            if status >= JOB_STATUS_LEVEL_RUNNING:
+                start = datetime.strptime(slurm_start, self.time_format)
+                start = local_timezone.localize(start)
+            if status >= JOB_STATUS_LEVEL_FINISHED or status < 0:
+                end = datetime.strptime(slurm_end, self.time_format)
+                end = local_timezone.localize(end)
+        except (KeyError, ValueError):
+            logger.warning('skipping unknown slurm job state %r, start %r, end %r.',
+                           slurm_state, slurm_start, slurm_end)
+            return None
         state = (status, start, end)
         if slurm_id:
             return (jobmap[int(slurm_id)], state)
         return state
 
     def status(self, job):
-        argv = ['sacct', '-n', '--format=State,Start,End', '-j', job.scheduler_id]
-        output = call(argv).split()
-        if len(output) >= 3:
-            return self.parse_status(*output[0:3])
-        argv = ['squeue', '-t', 'all', '-ho', '%t %S %e', '-j', job.scheduler_id]
-        return self.parse_status(*call(argv).split())
+        states = self.get_job_states([job])
+        if not states:
+            raise ValueError('slurm has no record of job %s' % job.scheduler_id)
+        return states[0][1]
+
+    def merge_states(self, states):
+        """Merge the (status, start, end) states of all tasks in a job array.
+
+        A job array has failed if any of its tasks has failed, and has
+        otherwise come as far as its least advanced task. It starts with its
+        first task and ends with its last.
+        """
+        if len(states) == 1:
+            return states[0]
+        statuses = [status for status, start, end in states]
+        failed = [status for status in statuses if status < 0]
+        status = min(failed or statuses)
+        starts = [start for _, start, end in states if start is not None]
+        ends = [end for _, start, end in states if end is not None]
+        start = min(starts) if starts else None
+        end = None
+        if ends and (status >= JOB_STATUS_LEVEL_FINISHED or status < 0):
+            end = max(ends)
+        return (status, start, end)
 
     def get_job_states(self, jobs):
-        jobs = [j for j in jobs if j.scheduler_id is not None]
-        ids = ','.join(j.scheduler_id for j in jobs if j.is_alive)
-        jobmap = dict((int(j.scheduler_id), j) for j in jobs)
-        argv = ['squeue', '-t', 'all', '-ho', '%t %S %e %i', '-j', ids]
-        job_states = []
-        for line in call(argv).splitlines():
-            words = line.split()
-            if not words:
-                continue
-            job_states.append(self.parse_status(*words, jobmap=jobmap))
-        return job_states
+        """Query the scheduler and return (job, (status, start, end)) tuples.
+
+        All live jobs are looked up in bulk by the transport. Jobs slurm has
+        no record of, or reports in states parse_status() does not know, are
+        left out. The tasks of job arrays are merged into
+        one state for the whole array.
+        """
+        jobmap = dict((str(j.scheduler_id), j) for j in jobs
+                      if j.scheduler_id is not None and j.is_alive)
+        task_states = dict()
+        for id, raw_state in self.transport.job_states(jobmap).items():
+            state = self.parse_status(*raw_state)
+            if state is not None:
+                task_states.setdefault(get_array_job_id(id), []).append(state)
+        return [(jobmap[id], self.merge_states(task_states[id]))
+                for id in jobmap if id in task_states]
 
 slurm = Slurm()
 schedulers.update(slurm=slurm)
@@ -185,14 +262,19 @@ class Slug(object):
     http://stackoverflow.com/questions/427102/what-is-a-slug-in-django
     A job slug is a valid uniq valid URL for a job.
     This class create a valid random char to use as slug in jobs
+
+    Slugs are drawn from the OS random source and carry over 100 bits of
+    entropy, so they are never checked for uniqueness up front. The unique
+    constraint on Job.slug catches collisions on insert, see Job.save().
     """
     chars = string.digits + string.ascii_lowercase
     length = 20
     regex = "[%s]{%d}" % (chars, length)
+    _random = random.SystemRandom()
 
     @classmethod
     def generate(cls):
-        return ''.join(random.choice(cls.chars) for i in range(cls.length))
+        return ''.join(cls._random.choice(cls.chars) for i in range(cls.length))
 
     @classmethod
     def validate(cls, slug):
@@ -263,48 +345,50 @@ def json_field_wrapper(name, json_default=None):
     return property(getter, setter)
 
 
-@transaction.commit_manually()
-def update_status_for_jobs(user, job_query_set):
-    """Update status for multiple jobs.
+def pickle_field_wrapper(name):
+    """Helper boilerplate function for storing pickled objects in a TextField.
+
+    Parameters
+    ----------
+    name : name of the TextField
+
+    Returns
+    -------
+    property ; with unpickling getter and pickling setter
+    """
+    def getter(obj):
+        value = getattr(obj, name)
+        if value is not None:
+            value = cPickle.loads(base64.b64decode(value))
+        return value
+
+    def setter(obj, value):
+        if value is not None:
+            value = base64.b64encode(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        setattr(obj, name, value)
+
+    return property(getter, setter)
+
+
+def get_live_jobs(**filters):
+    """Return an InheritanceQuerySet of all jobs that are still alive.
 
-    Aggregates jobs with same scheduler and uses .get_job_states(), in order to
-    reduce overhead from communication with schedulers.
+    Any keyword arguments are passed on to .filter().
     """
-    job_query_set.select_for_update()
-    try:
-        sched = dict()
-        for job in job_query_set:
-            sched.setdefault(schedulers[job.scheduler], []).append(job)
-        for scheduler, scheduler_jobs in sched.items():
-            states = scheduler.get_job_states(scheduler_jobs)
-            for job, (status, start_time, end_time) in states:
-                job.update_status(user, status, start_time, end_time)
-    finally:
-        transaction.commit()
-
-
-def call(argv):
-    p = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, errors = p.communicate()
-    if p.returncode != 0:
-        raise ValueError('%s command failed: %s, stdout: %s, stderr: %s' % (argv[0], argv, output, errors))
-    return output
+    return (Job.objects.select_subclasses()
+            .filter(status__gte=JOB_STATUS_LEVEL_ACCEPTED)
+            .filter(status__lt=JOB_STATUS_LEVEL_FINISHED)
+            .filter(**filters))
 
 
 class Job(models.Model, AgdaModelMixin):
 
     def __init__(self, *args, **kw):
         super(Job, self).__init__(*args, **kw)
-        slug = kw.get('slug')
-        if len(args) >= 2:
-            if slug:
-                raise TypeError("__init__() got multiple values for keyword argument 'slug'")
-            slug = args[1]
-        if not slug:
-            slug = Slug.generate()
-            while Job.objects.filter(slug=slug):
-                slug = Slug.generate()
-        self.slug = slug
+        # Jobs loaded from the database already have a slug (possibly
+        # deferred), and must not cost any extra queries.
+        if self.pk is None and not self.slug:
+            self.slug = Slug.generate()
 
     slug = models.CharField(max_length=Slug.length, unique=True)
     user = models.ForeignKey(AUTH_USER_MODEL, blank=True, null=True)  # Blank for anonymous jobs.
@@ -320,6 +404,7 @@ class Job(models.Model, AgdaModelMixin):
     result_files_json = models.TextField(blank=True, null=True)
     parameters_json = models.TextField(blank=True, null=True)
     statistics_json = models.TextField(blank=True, null=True)
+    array_size = models.IntegerField(default=0)  # Number of slurm job array tasks, 0 for ordinary jobs.
 
     tool = None
     files = dict()
@@ -343,6 +428,28 @@ class Job(models.Model, AgdaModelMixin):
     # Get an InheritanceQuerySet for Jobs in their proper subclasses.
     objects = InheritanceManager()
 
+    class Meta:
+        # For job lists, see get_jobs_page().
+        index_together = [('user', 'submission_date', 'id')]
+
+    # Number of slugs to try when inserting a new job.
+    max_slug_attempts = 5
+
+    def save(self, *args, **kw):
+        """Save the job, with a new slug if a new job's slug is already taken."""
+        if self.pk is not None:
+            return super(Job, self).save(*args, **kw)
+        for attempt in range(self.max_slug_attempts):
+            try:
+                with transaction.atomic():
+                    return super(Job, self).save(*args, **kw)
+            except IntegrityError:
+                is_last_attempt = attempt == self.max_slug_attempts - 1
+                if is_last_attempt or not Job.objects.filter(slug=self.slug).exists():
+                    raise
+                logger.warning('job slug %s already taken, generating a new one.', self.slug)
+                self.slug = Slug.generate()
+
     def log_action(self, action_flag, user, message, object_repr):
         """Allow logging of anonymously submitted jobs."""
         user = get_user_or_anonymous(user)
@@ -380,14 +487,100 @@ class Job(models.Model, AgdaModelMixin):
         if os.path.exists(d):
             shutil.rmtree(d)
 
+    def clear_workdir(self, keep=()):
+        """Remove everything in the workdir except the paths in keep."""
+        if not os.path.isdir(self.workdir):
+            return
+        keep = set(os.path.abspath(path) for path in keep)
+        for name in os.listdir(self.workdir):
+            path = os.path.join(self.workdir, name)
+            if os.path.abspath(path) in keep:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
     def move_workdir_to_errordir(self):
         if os.path.exists(self.workdir):
             shutil.move(self.workdir, self.errordir)
 
     def write_workfile(self, path, contents):
-        if not os.path.isdir(self.workdir):
+        self.open_workfile(path, 'w').write(contents)
+
+    def open_workfile(self, path, mode='r'):
+        if 'r' not in mode and not os.path.isdir(self.workdir):
             self.make_jobdir('work')
-        open(self.workfile(path), 'w').write(contents)
+        return open(self.workfile(path), mode)
+
+    def shard_name(self, path, shard):
+        """Name of the shard of path for job array task shard.
+
+        path may be a key in .files. Example: shard_name('query', 3) gives
+        'query-3.fasta' if .files['query'] is 'query.fasta'.
+        """
+        root, ext = os.path.splitext(self.files.get(path, path))
+        return '%s-%s%s' % (root, shard, ext)
+
+    def task_name(self, path):
+        """Name of path for use in job scripts.
+
+        For job arrays, this is the shard of path for the running task.
+        """
+        if self.array_size:
+            return self.shard_name(path, '$SLURM_ARRAY_TASK_ID')
+        return self.files.get(path, path)
+
+    def write_sharded_workfile(self, path, entries):
+        """Write the FastaList entries to a workfile, and split them in shards
+        for a job array if there are enough of them.
+
+        entries may also be a fasta.FastaFile, e.g: an upload that was written
+        straight to the workfile while it was validated. It is then split
+        while streaming it from disk.
+
+        Sets .array_size to the number of shards, which is 0 if there are too
+        few entries to make a job array worthwhile. See settings.JOB_ARRAY_*.
+        """
+        streamed = isinstance(entries, fasta.FastaFile)
+        if not streamed:
+            with self.open_workfile(path, 'w') as f:
+                entries.write_to(f)
+        elif entries.path != self.workfile(path):
+            with self.open_workfile(path, 'w') as f:
+                shutil.copyfileobj(open(entries.path), f)
+        shards = min(settings.JOB_ARRAY_MAX_SHARDS, len(entries) // settings.JOB_ARRAY_MIN_SHARD_SEQUENCES)
+        self.array_size = shards if shards > 1 else 0
+        if not self.array_size:
+            return
+        if not streamed:
+            for i, shard in enumerate(entries.split(self.array_size)):
+                with self.open_workfile(self.shard_name(path, i), 'w') as f:
+                    shard.write_to(f)
+            return
+        for i, texts in enumerate(entries.iter_splits(self.array_size)):
+            with self.open_workfile(self.shard_name(path, i), 'w') as shard:
+                shard.writelines(texts)
+
+    def open_shards(self, path):
+        """Iterate over the shards of workfile path, opened for reading."""
+        for i in range(self.array_size):
+            yield open(self.workfile(self.shard_name(path, i)))
+
+    def concatenate_shards(self, path):
+        """Concatenate the shards of workfile path into path."""
+        with open(self.workfile(path), 'w') as merged:
+            for shard in self.open_shards(path):
+                shutil.copyfileobj(shard, merged)
+
+    def merge_shards(self):
+        """Merge the output shards of a finished job array into result files.
+
+        Called by on_status_changed() for jobs with .array_size set, before
+        the result files are saved. Subclasses that run as job arrays must
+        override this method.
+        """
+        raise NotImplementedError('%s does not run as a job array' % self.__class__.__name__)
 
     def make_workdir(self, path):
         if not os.path.isdir(self.workdir):
@@ -419,6 +612,37 @@ class Job(models.Model, AgdaModelMixin):
                 os.makedirs(dir, 0750)
             shutil.copy2(src, dst)
 
+    def set_submission_info(self, user, submission_ip, name):
+        """Set user, name, submission_ip and submission_date (unless set)."""
+        if not name:
+            name = self.tool.displayname + ' job'
+        self.name = name
+        if self.submission_date is None:
+            self.submission_date = datetime.now()
+        self.submission_ip = submission_ip
+        if user.is_authenticated():
+            self.user = user
+
+    def enqueue(self, user, submission_ip, name, *args, **kw):
+        """Queue the job for submission by the job_submit_daemon command.
+
+        Takes the same arguments as submit(), which the daemon will call
+        later on, outside of the web request. This method only sets user,
+        name, submission_ip and submission_date, calls .save(), logs changes
+        and stores the remaining arguments in the queue, which means that they
+        must be picklable. The job stays accepted until it is submitted.
+        """
+        diff = ModelDiffer(self)
+        self.set_submission_info(user, submission_ip, name)
+        self.save()
+        queued = QueuedSubmission(job=self)
+        if user.is_authenticated():
+            queued.user = user
+        queued.arguments = (args, kw)
+        queued.save()
+        diff.update(self)
+        self.log_change(user, diff.get_change_message() + ' Queued for submission.')
+
     def submit(self, user, submission_ip, name, *args, **kw):
         """Boilerplate logging and error handling around job submission.
 
@@ -432,28 +656,35 @@ class Job(models.Model, AgdaModelMixin):
         - calls .save()
         - logs changes.
         - calls register_error() on exceptions.
+        - publishes the new status, see jobs.events.
 
         It is up to .on_submit() to do all useful work with job preparation and
         actual submission to the scheduler.
+
+        If the scheduler is busy, the job is left accepted and SchedulerBusy is
+        raised, so the submission can be retried. The workdir is emptied, but
+        for the files of any fasta.FastaFile arguments, as uploads are written
+        straight to the workdir before the job is submitted.
         """
         log_only_field_name_for = kw.get('log_only_field_name_for', ['statistics'])
         diff = ModelDiffer(self)
         try:
-            if not name:
-                name = self.tool.displayname + ' job'
-            self.name = name
+            self.set_submission_info(user, submission_ip, name)
             self.status = JOB_STATUS_LEVEL_SUBMITTED
-            self.submission_date = datetime.now()
-            self.submission_ip = submission_ip
-            if user.is_authenticated():
-                self.user = user
             self.on_submit(*args, **kw)
+        except SchedulerBusy:
+            self.status = JOB_STATUS_LEVEL_ACCEPTED
+            self.scheduler_id = None
+            uploads = [arg.path for arg in args + tuple(kw.values()) if isinstance(arg, fasta.FastaFile)]
+            self.clear_workdir(keep=uploads)
+            raise
         except:
             self.register_error(user, 'submission failed')
         finally:
             diff.update(self)
             self.log_change(user, diff.get_change_message(log_only_field_name_for))
             self.save()
+            publish_status(self)
 
     def on_submit(self):
         """Prepare files and submit job. Called by .submit().
@@ -519,6 +750,7 @@ class Job(models.Model, AgdaModelMixin):
         - call save()
         - call register_error() on on_status_change() exceptions
         - log changes
+        - publish the new status, see jobs.events.
         """
         if diff is None:
             diff = ModelDiffer(self)
@@ -542,6 +774,11 @@ class Job(models.Model, AgdaModelMixin):
             self.log_change(user, diff.get_change_message())
         if self.status < 0:
             self.cancel()
+        self.tidy_jobdirs()
+        publish_status(self)
+
+    def tidy_jobdirs(self):
+        """Remove or move job directories that the job no longer needs in its current status."""
         if self.status == JOB_STATUS_LEVEL_DELETED:
             self.remove_jobdir('error')
             self.remove_jobdir('results')
@@ -572,10 +809,78 @@ class Job(models.Model, AgdaModelMixin):
         Since update_status() already does all of that.
         """
         if status == JOB_STATUS_LEVEL_FINISHED:
+            if self.array_size:
+                self.merge_shards()
             for file in self.result_files.values():
                 self.save_resultfile(file)
 
 
+class QueuedSubmission(models.Model):
+    """A job waiting to be submitted by the job_submit_daemon command.
+
+    See Job.enqueue() and jobs.queue.
+    """
+    job = models.OneToOneField(Job)
+    user = models.ForeignKey(AUTH_USER_MODEL, blank=True, null=True)  # Blank for anonymous jobs.
+    queued_date = models.DateTimeField('queued date', auto_now_add=True)
+    next_attempt_date = models.DateTimeField('next attempt date', default=timezone.now, db_index=True)
+    attempts = models.IntegerField(default=0)
+    arguments_pickle = models.TextField()
+
+    arguments = pickle_field_wrapper('arguments_pickle')
+
+    def __unicode__(self):
+        return u"%s:%s" % (self.id, self.job_id)
+
+
+def get_jobs_page(user, after=None, size=100):
+    """Return one page of the (non-deleted) jobs of user, newest first.
+
+    Uses keyset pagination on (submission_date, id), which is backed by an
+    index and costs the same for any page. The jobs are returned in their
+    proper subclasses, but subclass tables are only joined for the jobs on
+    the page.
+
+    Parameters
+    ----------
+    user : the owner of the jobs.
+    after : the id of the last job on the previous page, None for the first page.
+    size : max number of jobs on the page.
+
+    Returns
+    -------
+    (jobs, next), where next is the after value for the next page, or None
+    if this is the last page.
+    """
+    jobs = (Job.objects.filter(user=user)
+            .exclude(status=JOB_STATUS_LEVEL_DELETED)
+            .order_by('-submission_date', '-id')
+            .values_list('id', flat=True))
+    if after is None:
+        ids = list(jobs[:size + 1])
+    else:
+        try:
+            last_date = Job.objects.filter(user=user).values_list('submission_date', flat=True).get(pk=after)
+        except Job.DoesNotExist:
+            raise Http404('No such job')
+        undated = jobs.filter(submission_date=None)
+        # Jobs without submission date sort last.
+        if last_date is None:
+            ids = list(undated.filter(id__lt=after)[:size + 1])
+        else:
+            # The plain range condition lets the index bound the scan, the
+            # rest breaks ties between jobs submitted at the same time.
+            dated = (jobs.filter(submission_date__lte=last_date)
+                     .filter(Q(submission_date__lt=last_date) | Q(submission_date=last_date, id__lt=after)))
+            ids = list(dated[:size + 1])
+            if len(ids) <= size:
+                ids.extend(undated[:size + 1 - len(ids)])
+    next = ids[size - 1] if len(ids) > size else None
+    ids = ids[:size]
+    subclassed = dict((job.id, job) for job in Job.objects.filter(id__in=ids).select_subclasses())
+    return [subclassed[id] for id in ids if id in subclassed], next
+
+
 def get_job_or_404(select_for_update=False, **kw):
     jobs = Job.objects.filter(**kw).select_subclasses()
     if select_for_update:
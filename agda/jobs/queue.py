@@ -0,0 +1,109 @@
+"""Submission queue for jobs.
+
+Views accept jobs and put them in the queue using Job.enqueue(), which is
+quick and does not involve the scheduler. The job_submit_daemon management
+command then drains the queue in batches using submit_queued_jobs(), calling
+Job.submit() for each queued job in a pool of worker threads.
+
+When the scheduler refuses to accept more jobs, the rest of the batch is left
+in the queue and the failed submission is retried later with exponential
+backoff.
+"""
+from datetime import timedelta
+import logging
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import (connection,
+                       transaction)
+from django.db.models import F
+from django.utils import timezone
+
+from jobs.models import (JOB_STATUS_LEVEL_ACCEPTED,
+                         Job,
+                         QueuedSubmission)
+from jobs.transports import SchedulerBusy
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before the first retry of a job that the scheduler refused.
+# The wait is doubled for each failed attempt, up to max_retry_delay.
+retry_delay = 30
+max_retry_delay = 3600
+
+
+def get_retry_date(attempts):
+    delay = min(max_retry_delay, retry_delay * 2 ** attempts)
+    return timezone.now() + timedelta(seconds=delay)
+
+
+def submit_queued(queued_id, busy=None):
+    """Submit the queued job with the given QueuedSubmission id.
+
+    busy should be a threading.Event shared between workers. It is set if
+    the scheduler refuses the job, and no further submissions are attempted
+    once it is set.
+
+    Returns
+    -------
+    True if the job was submitted or dropped from the queue, False if the
+    scheduler was busy, and None if the job was skipped.
+    """
+    if busy is not None and busy.is_set():
+        return None
+    try:
+        with transaction.atomic():
+            queued = QueuedSubmission.objects.select_for_update().get(pk=queued_id)
+            job = Job.objects.select_subclasses().select_for_update().get(pk=queued.job_id)
+            # Jobs deleted while in the queue are just dropped.
+            if job.status == JOB_STATUS_LEVEL_ACCEPTED:
+                args, kw = queued.arguments
+                user = queued.user or AnonymousUser()
+                job.submit(user, job.submission_ip, job.name, *args, **kw)
+            queued.delete()
+        return True
+    except QueuedSubmission.DoesNotExist:
+        # Taken care of by another worker.
+        return True
+    except SchedulerBusy, e:
+        if busy is not None:
+            busy.set()
+        logger.warning('scheduler busy, postponing queued job %s: %s', queued_id, e)
+        (QueuedSubmission.objects.filter(pk=queued_id)
+         .update(attempts=F('attempts') + 1,
+                 next_attempt_date=get_retry_date(queued.attempts)))
+        return False
+
+
+def submit_queued_in_worker(queued_id, busy):
+    """submit_queued() for use in worker threads."""
+    try:
+        return submit_queued(queued_id, busy)
+    finally:
+        # Worker threads each have their own connection, don't leak them.
+        connection.close()
+
+
+def get_due_ids(batch_size):
+    """Ids of the batch_size queued submissions that are due first."""
+    return list(QueuedSubmission.objects
+                .filter(next_attempt_date__lte=timezone.now())
+                .order_by('next_attempt_date', 'id')
+                .values_list('id', flat=True)[:batch_size])
+
+
+def submit_queued_jobs(pool, batch_size, busy):
+    """Submit a batch of due queued jobs in parallel in pool.
+
+    pool should be a multiprocessing.pool.ThreadPool, and busy a
+    threading.Event that should be cleared before the call and is set if
+    the scheduler was busy.
+
+    Returns
+    -------
+    The number of queued jobs that were handled.
+    """
+    ids = get_due_ids(batch_size)
+    if not ids:
+        return 0
+    results = pool.map(lambda id: submit_queued_in_worker(id, busy), ids)
+    return results.count(True)
@@ -1,11 +1,19 @@
+from datetime import timedelta
 from functools import wraps
+import json
+import threading
+import time
 
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
+from django.utils import timezone
 
 from profiles.models import AgdaUser
 from mdr.models import MDRScanJob
+from jobs import transports
+from jobs.events import publish_status
+from jobs.models import get_jobs_page
 
 
 fake_slug = 'asdfasdfasdfasdfasdf'
@@ -60,6 +68,38 @@ class TestJobViews(TestCase):
         self.assertEquals(response.status_code, 200)
         self.assertContains(response, 'Egg number two')
 
+    @with_two_jobs
+    def test_list_jobs_pages(self):
+        self.login()
+        job3 = MDRScanJob.objects.create(name='Egg number three', user=self.user)
+        url = reverse("jobs.views.list_jobs")
+        response = self.client.get(url, dict(limit=1))
+        self.assertContains(response, 'Egg number three')
+        self.assertNotContains(response, 'Egg number two')
+        self.assertEquals(response.context['next'], job3.id)
+
+        response = self.client.get(url, dict(limit=1, after=job3.id))
+        self.assertContains(response, 'Egg number two')
+        self.assertNotContains(response, 'Egg number three')
+        self.assertEquals(response.context['next'], None)
+
+    @with_two_jobs
+    def test_list_jobs_pages_with_equal_submission_dates(self):
+        now = timezone.now()
+        earlier = now - timedelta(minutes=1)
+        dates = [earlier, now, earlier, now, now]
+        jobs = [MDRScanJob.objects.create(name='Egg %s' % i, user=self.user, submission_date=date)
+                for i, date in enumerate(dates)]
+        expected = [jobs[4].id, jobs[3].id, jobs[1].id, jobs[2].id, jobs[0].id, self._job2.id]
+        seen = []
+        after = None
+        while True:
+            page, after = get_jobs_page(self.user, after, size=2)
+            seen.extend(job.id for job in page)
+            if after is None:
+                break
+        self.assertEquals(seen, expected)
+
     @with_two_jobs
     def test_view_job_when_not_logged_in(self):
         url = reverse("jobs.views.show_results", args=[self.job1.slug])
@@ -87,6 +127,55 @@ class TestJobViews(TestCase):
         self.assertContains(response, 'Egg number two')
         self.assertNotContains(response, 'Take')
 
+    @with_two_jobs
+    def test_view_job_does_not_poll_scheduler(self):
+        def call(argv):
+            raise AssertionError('results view called %s' % argv[0])
+        orig_call, transports.call = transports.call, call
+        try:
+            url = reverse("jobs.views.show_results", args=[self.job1.slug])
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(self.job1.status, 10)
+        finally:
+            transports.call = orig_call
+
+    @override_settings(JOB_STATUS_WAIT_TIMEOUT=0, JOB_STATUS_EVENTS_CACHE='default')
+    @with_two_jobs
+    def test_wait_for_status(self):
+        url = reverse("jobs.views.wait_for_status", args=[self.job1.slug])
+        response = self.client.get(url, dict(status=10))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content)['changed'], False)
+
+        response = self.client.get(url, dict(status=0))
+        data = json.loads(response.content)
+        self.assertEquals((data['changed'], data['status']), (True, 10))
+
+        # Waiting does not overwrite statuses published after the job was read.
+        job = self.job1
+        job.status = 20
+        publish_status(job)
+        response = self.client.get(url, dict(status=10))
+        data = json.loads(response.content)
+        self.assertEquals((data['changed'], data['status']), (True, 20))
+
+    @override_settings(JOB_STATUS_WAIT_TIMEOUT=10, JOB_STATUS_WAIT_POLL_INTERVAL=0.05,
+                       JOB_STATUS_EVENTS_CACHE='default')
+    @with_two_jobs
+    def test_wait_for_published_status(self):
+        url = reverse("jobs.views.wait_for_status", args=[self.job1.slug])
+        job = self.job1
+        job.status = 20
+        publisher = threading.Timer(0.2, publish_status, [job])
+        publisher.start()
+        started = time.time()
+        response = self.client.get(url, dict(status=10))
+        publisher.join()
+        data = json.loads(response.content)
+        self.assertEquals((data['changed'], data['status'], data['status_name']), (True, 20, 'Queued'))
+        self.assertTrue(time.time() - started < 5)
+
     @with_two_jobs
     def test_get_unexisting_job(self):
         url = reverse("jobs.views.show_results", args=[fake_slug])
@@ -1,3 +1,442 @@
-from django.test import TestCase
+from BaseHTTPServer import (BaseHTTPRequestHandler,
+                            HTTPServer)
+import httplib
+import json
+import os
+import shutil
+import tempfile
+import threading
 
-# Create your tests here.
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import AnonymousUser
+from django.test import (SimpleTestCase,
+                         TestCase)
+
+from core import fasta
+from datisca.models import DatiscaNoduleBlastJob
+from jobs import (models as job_models,
+                  transports)
+from jobs.models import (JOB_STATUS_LEVEL_ACCEPTED,
+                         JOB_STATUS_LEVEL_DELETED,
+                         JOB_STATUS_LEVEL_FAILED,
+                         JOB_STATUS_LEVEL_FINISHED,
+                         JOB_STATUS_LEVEL_QUEUED,
+                         JOB_STATUS_LEVEL_RUNNING,
+                         JOB_STATUS_LEVEL_SUBMITTED,
+                         Job,
+                         QueuedSubmission,
+                         Scheduler,
+                         Slurm,
+                         schedulers)
+from jobs.queue import submit_queued
+from jobs.transitions import update_status_for_jobs
+from jobs.transports import (SchedulerBusy,
+                             SlurmCommandTransport,
+                             SlurmRestTransport)
+from mdr.models import MDRScanJob
+
+
+class FakeJob(object):
+    def __init__(self, scheduler_id, status=JOB_STATUS_LEVEL_SUBMITTED):
+        self.scheduler_id = scheduler_id
+        self.status = status
+        self.is_alive = 0 <= status < JOB_STATUS_LEVEL_FINISHED
+
+
+class FakeCall(object):
+    """Stand-in for jobs.transports.call that records argvs and replays output."""
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.argvs = []
+
+    def __call__(self, argv):
+        self.argvs.append(argv)
+        output = self.outputs[argv[0]]
+        if isinstance(output, Exception):
+            raise output
+        return output
+
+
+class TestSlurmJobStates(SimpleTestCase):
+    sacct = ('1|COMPLETED|2014-06-01T10:00:00|2014-06-01T11:00:00\n'
+             '2|CANCELLED by 42|Unknown|2014-06-01T11:00:00\n')
+    squeue = ('3 R 2014-06-01T10:00:00 2014-06-02T10:00:00\n'
+              '4 PD N/A N/A\n')
+
+    def setUp(self):
+        self.orig_call = transports.call
+
+    def tearDown(self):
+        transports.call = self.orig_call
+
+    def get_states(self, jobs, outputs):
+        transports.call = FakeCall(outputs)
+        slurm = Slurm(SlurmCommandTransport())
+        states = dict((job.scheduler_id, state[0]) for job, state in slurm.get_job_states(jobs))
+        return states, transports.call.argvs
+
+    def test_sacct_then_squeue_for_missing(self):
+        jobs = [FakeJob(str(i)) for i in range(1, 6)]
+        states, argvs = self.get_states(jobs, dict(sacct=self.sacct, squeue=self.squeue))
+        self.assertEquals(states, {'1': JOB_STATUS_LEVEL_FINISHED,
+                                   '2': JOB_STATUS_LEVEL_FAILED,
+                                   '3': JOB_STATUS_LEVEL_RUNNING,
+                                   '4': JOB_STATUS_LEVEL_QUEUED})
+        self.assertEquals([argv[0] for argv in argvs], ['sacct', 'squeue'])
+        self.assertEquals(sorted(argvs[1][-1].split(',')), ['3', '4', '5'])
+
+    def test_ids_are_chunked(self):
+        transport = SlurmCommandTransport()
+        transport.max_ids_per_call = 2
+        jobs = [FakeJob(str(i)) for i in range(5)]
+        transports.call = FakeCall(dict(sacct='', squeue=ValueError()))
+        self.assertEquals(Slurm(transport).get_job_states(jobs), [])
+        self.assertEquals([argv[0] for argv in transports.call.argvs], ['sacct'] * 3 + ['squeue'] * 3)
+
+    def test_array_tasks_are_merged(self):
+        sacct = ('5_0|COMPLETED|2014-06-01T10:00:00|2014-06-01T11:00:00\n'
+                 '5_1|RUNNING|2014-06-01T10:30:00|Unknown\n'
+                 '5_[2-3]|PENDING|Unknown|Unknown\n'
+                 '6_0|COMPLETED|2014-06-01T10:00:00|2014-06-01T11:00:00\n'
+                 '6_1|FAILED|2014-06-01T10:00:00|2014-06-01T10:10:00\n')
+        jobs = [FakeJob('5'), FakeJob('6')]
+        states, argvs = self.get_states(jobs, dict(sacct=sacct))
+        self.assertEquals(states, {'5': JOB_STATUS_LEVEL_QUEUED,
+                                   '6': JOB_STATUS_LEVEL_FAILED})
+        self.assertEquals([argv[0] for argv in argvs], ['sacct'])
+
+    def test_unknown_states_are_skipped(self):
+        sacct = ('1|REVOKED|2014-06-01T10:00:00|2014-06-01T11:00:00\n'
+                 '2|COMPLETED|Unknown|Unknown\n'
+                 '3|COMPLETED|2014-06-01T10:00:00|2014-06-01T11:00:00\n'
+                 '4_0|SPECIAL_EXIT|2014-06-01T10:00:00|2014-06-01T11:00:00\n'
+                 '4_1|RUNNING|2014-06-01T10:00:00|Unknown\n')
+        jobs = [FakeJob(str(i)) for i in range(1, 5)]
+        states, argvs = self.get_states(jobs, dict(sacct=sacct, squeue=''))
+        self.assertEquals(states, {'3': JOB_STATUS_LEVEL_FINISHED,
+                                   '4': JOB_STATUS_LEVEL_RUNNING})
+
+    def test_dead_jobs_are_not_queried(self):
+        jobs = [FakeJob('1', JOB_STATUS_LEVEL_FINISHED), FakeJob(None)]
+        states, argvs = self.get_states(jobs, dict())
+        self.assertEquals(states, {})
+        self.assertEquals(argvs, [])
+
+
+class FakeSlurmrestdHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    responses_by_path = {
+        '/slurm/v0.0.39/job/submit': dict(job_id=17),
+        '/slurm/v0.0.39/job/17': dict(),
+        '/slurm/v0.0.39/jobs': dict(jobs=[dict(job_id=17, job_state=['RUNNING'],
+                                               start_time=dict(set=True, number=1401609600),
+                                               end_time=dict(set=False, number=0))]),
+        '/slurmdb/v0.0.39/job/18': dict(jobs=[dict(job_id=18, state=dict(current=['COMPLETED']),
+                                                   time=dict(start=1401609600, end=1401613200))]),
+    }
+
+    def respond(self):
+        length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(length) if length else None
+        self.server.requests.append((self.command, self.path, body, self.client_address))
+        if self.server.drop:
+            # Hang up without responding, as after a timeout.
+            self.server.drop -= 1
+            self.close_connection = 1
+            return
+        data = self.responses_by_path.get(self.path)
+        status = 200
+        if data is None:
+            status, data = 404, dict(errors=['no such path'])
+        text = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    do_GET = do_POST = do_DELETE = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSlurmRestTransport(SimpleTestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), FakeSlurmrestdHandler)
+        self.server.requests = []
+        self.server.drop = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.transport = SlurmRestTransport('http://127.0.0.1:%s' % self.server.server_port,
+                                            user='agda', token='secret')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_submit_status_cancel(self):
+        script = os.path.join(self.tmpdir, 'job.sh')
+        open(script, 'w').write('#!/bin/sh\necho hello\n')
+        options = dict(workdir=self.tmpdir, stdout='std.out', stderr='std.err',
+                       stdin=None, nodes=1, tasks=2, cpus=4, time=60)
+        self.assertEquals(self.transport.submit(script, ['x'], options), '17')
+        states = self.transport.job_states(['17', '18', '19'])
+        self.assertEquals(sorted(states), ['17', '18'])
+        self.assertEquals(states['17'][0], 'RUNNING')
+        self.assertEquals(states['17'][2], 'Unknown')
+        self.assertEquals(states['18'][0], 'COMPLETED')
+        self.transport.cancel('17')
+
+        method, path, body, client = self.server.requests[0]
+        data = json.loads(body)
+        self.assertEquals(data['script'], '#!/bin/sh\necho hello\n')
+        self.assertEquals(data['job']['tasks'], 2)
+        self.assertEquals(data['job']['cpus_per_task'], 4)
+        self.assertEquals(data['job']['argv'], [script, 'x'])
+        # Jobs get the environment of the submitting process, as with sbatch.
+        self.assertIn('PATH=%s' % os.environ['PATH'], data['job']['environment'])
+        self.assertEquals([r[0] for r in self.server.requests], ['POST', 'GET', 'GET', 'GET', 'DELETE'])
+        # All requests went over the same keep-alive connection.
+        self.assertEquals(len(set(r[3] for r in self.server.requests)), 1)
+
+    def test_only_idempotent_requests_are_retried(self):
+        script = os.path.join(self.tmpdir, 'job.sh')
+        open(script, 'w').write('#!/bin/sh\n')
+        options = dict(workdir=self.tmpdir, stdout='std.out', stderr='std.err',
+                       stdin=None, nodes=1, tasks=1, time=60)
+        self.server.drop = 1
+        self.assertRaises(httplib.HTTPException, self.transport.submit, script, [], options)
+        self.assertEquals(len(self.server.requests), 1)
+        self.server.drop = 1
+        self.transport.cancel('17')
+        self.assertEquals([method for method, path, body, client in self.server.requests], ['POST', 'DELETE', 'DELETE'])
+
+    def test_configured_environment(self):
+        self.transport.environment = dict(PATH='/opt/bin:/bin', PYTHONPATH='/opt/lib')
+        script = os.path.join(self.tmpdir, 'job.sh')
+        open(script, 'w').write('#!/bin/sh\n')
+        options = dict(workdir=self.tmpdir, stdout='std.out', stderr='std.err',
+                       stdin=None, nodes=1, tasks=1, time=60)
+        self.transport.submit(script, [], options)
+        data = json.loads(self.server.requests[0][2])
+        self.assertEquals(data['job']['environment'], ['PATH=/opt/bin:/bin', 'PYTHONPATH=/opt/lib'])
+
+    def test_rejected_submit_raises(self):
+        options = dict(workdir=self.tmpdir, stdout='std.out', stderr='std.err',
+                       stdin=None, nodes=1, tasks=1, time=60)
+        self.assertRaises(ValueError, self.transport.submit, 'job.sh', [], options, ['--array=1-4'])
+
+
+class TestSubmissionQueue(TestCase):
+    def setUp(self):
+        self.submitted = []
+        self.busy = False
+        self.orig_on_submit = MDRScanJob.on_submit
+
+        def on_submit(job, entries):
+            if self.busy:
+                raise SchedulerBusy('slurm temporarily unable to accept job')
+            self.submitted.append(entries)
+            job.scheduler_id = '12'
+        MDRScanJob.on_submit = on_submit
+        self.job = MDRScanJob.objects.create(status=JOB_STATUS_LEVEL_ACCEPTED)
+        self.job.enqueue(AnonymousUser(), '127.0.0.1', 'Queued egg', ['entries'])
+
+    def tearDown(self):
+        MDRScanJob.on_submit = self.orig_on_submit
+
+    @property
+    def queued(self):
+        return QueuedSubmission.objects.get(job=self.job)
+
+    def test_enqueue_does_not_submit(self):
+        job = MDRScanJob.objects.get(pk=self.job.id)
+        self.assertEquals(job.status, JOB_STATUS_LEVEL_ACCEPTED)
+        self.assertEquals(job.name, 'Queued egg')
+        self.assertEquals(self.submitted, [])
+        self.assertEquals(self.queued.arguments, ((['entries'],), {}))
+
+    def test_submit_queued(self):
+        self.assertEquals(submit_queued(self.queued.id), True)
+        job = MDRScanJob.objects.get(pk=self.job.id)
+        self.assertEquals(job.status, JOB_STATUS_LEVEL_SUBMITTED)
+        self.assertEquals(job.scheduler_id, '12')
+        self.assertEquals(self.submitted, [['entries']])
+        self.assertFalse(QueuedSubmission.objects.exists())
+
+    def test_busy_scheduler_keeps_job_queued(self):
+        self.busy = True
+        self.assertEquals(submit_queued(self.queued.id), False)
+        self.assertEquals(MDRScanJob.objects.get(pk=self.job.id).status, JOB_STATUS_LEVEL_ACCEPTED)
+        self.assertEquals(self.queued.attempts, 1)
+        self.busy = False
+        self.assertEquals(submit_queued(self.queued.id), True)
+        self.assertEquals(MDRScanJob.objects.get(pk=self.job.id).status, JOB_STATUS_LEVEL_SUBMITTED)
+
+    def test_busy_scheduler_keeps_uploaded_query(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.addCleanup(job_models.jobdirs.__setitem__, 'work', job_models.jobdirs['work'])
+        job_models.jobdirs['work'] = tmpdir
+
+        def on_submit(job, entries):
+            job.write_sharded_workfile('query', entries)
+            job.write_workfile('mdrscan.sh', '')
+            if self.busy:
+                raise SchedulerBusy('slurm temporarily unable to accept job')
+            self.submitted.append(open(entries.path).read())
+            job.scheduler_id = '12'
+        MDRScanJob.on_submit = on_submit
+        # Uploads are written to the workdir when the job is accepted.
+        job = MDRScanJob.objects.create(status=JOB_STATUS_LEVEL_ACCEPTED)
+        job.write_workfile('query', '>a\nACD\n')
+        job.enqueue(AnonymousUser(), '127.0.0.1', 'Uploaded egg', fasta.FastaFile(job.workfile('query'), 1, 3))
+        queued = QueuedSubmission.objects.get(job=job)
+        self.busy = True
+        self.assertEquals(submit_queued(queued.id), False)
+        self.assertEquals(os.listdir(job.workdir), ['query.fasta'])
+        self.busy = False
+        self.assertEquals(submit_queued(queued.id), True)
+        self.assertEquals(self.submitted, ['>a\nACD\n'])
+
+
+class TestJobSlugs(TestCase):
+    def test_loading_jobs_costs_no_extra_queries(self):
+        for i in range(3):
+            MDRScanJob.objects.create()
+        with self.assertNumQueries(1):
+            jobs = list(MDRScanJob.objects.all())
+        self.assertEquals(len(set(job.slug for job in jobs)), 3)
+
+    def test_taken_slug_is_replaced(self):
+        job1 = MDRScanJob.objects.create()
+        job2 = MDRScanJob(slug=job1.slug)
+        job2.save()
+        self.assertNotEquals(job2.slug, job1.slug)
+        self.assertEquals(MDRScanJob.objects.get(pk=job2.id).slug, job2.slug)
+
+
+class FakeScheduler(Scheduler):
+    """Reports the statuses in .states, and deletes .deleted jobs while asked."""
+    def __init__(self):
+        self.states = dict()
+        self.deleted = []
+        self.cancelled = []
+
+    def get_job_states(self, jobs):
+        MDRScanJob.objects.filter(id__in=self.deleted).update(status=JOB_STATUS_LEVEL_DELETED)
+        return [(job, (self.states[job.id], None, None)) for job in jobs if job.id in self.states]
+
+    def cancel(self, job):
+        self.cancelled.append(job.id)
+
+
+class TestBulkStatusUpdate(TestCase):
+    def setUp(self):
+        self.scheduler = schedulers['fake'] = FakeScheduler()
+        self.orig_on_status_changed = MDRScanJob.on_status_changed
+        MDRScanJob.on_status_changed = lambda job, status: None
+        self.jobs = [MDRScanJob.objects.create(scheduler='fake', status=JOB_STATUS_LEVEL_SUBMITTED)
+                     for i in range(4)]
+
+    def tearDown(self):
+        MDRScanJob.on_status_changed = self.orig_on_status_changed
+        del schedulers['fake']
+
+    def status(self, job):
+        return MDRScanJob.objects.get(pk=job.id).status
+
+    def test_update_status_for_jobs(self):
+        running, finished, failed, deleted = self.jobs
+        self.scheduler.states = {running.id: JOB_STATUS_LEVEL_RUNNING,
+                                 finished.id: JOB_STATUS_LEVEL_FINISHED,
+                                 failed.id: JOB_STATUS_LEVEL_FAILED,
+                                 deleted.id: JOB_STATUS_LEVEL_FINISHED}
+        self.scheduler.deleted = [deleted.id]
+        applied = update_status_for_jobs(AnonymousUser(), list(MDRScanJob.objects.all()), workers=2)
+        self.assertEquals(len(applied), 3)
+        self.assertEquals(self.status(running), JOB_STATUS_LEVEL_RUNNING)
+        self.assertEquals(self.status(finished), JOB_STATUS_LEVEL_FINISHED)
+        self.assertEquals(self.status(failed), JOB_STATUS_LEVEL_FAILED)
+        # Deleted while the scheduler was asked, so left alone.
+        self.assertEquals(self.status(deleted), JOB_STATUS_LEVEL_DELETED)
+        self.assertEquals(self.scheduler.cancelled, [failed.id])
+        self.assertEquals(LogEntry.objects.count(), 3)
+
+
+class TestJobArrays(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.orig_jobdirs = dict(job_models.jobdirs)
+        job_models.jobdirs['work'] = self.tmpdir
+
+    def tearDown(self):
+        job_models.jobdirs.update(self.orig_jobdirs)
+        shutil.rmtree(self.tmpdir)
+
+    def entries(self, n):
+        return fasta.FastaList(fasta.FastaEntry('seq%s' % i, '', 'ACDE' * (i % 3 + 1)) for i in range(n))
+
+    def read_shards(self, job, path):
+        return [shard.read() for shard in job.open_shards(path)]
+
+    def test_shard_counts(self):
+        with self.settings(JOB_ARRAY_MIN_SHARD_SEQUENCES=10, JOB_ARRAY_MAX_SHARDS=4):
+            for n, array_size in [(9, 0), (19, 0), (20, 2), (29, 2), (30, 3), (1000, 4)]:
+                job = MDRScanJob()
+                entries = self.entries(n)
+                job.write_sharded_workfile('query', entries)
+                self.assertEquals(job.array_size, array_size)
+                self.assertEquals(job.open_workfile('query').read(), entries.to_str() + '\n')
+                if array_size:
+                    shards = self.read_shards(job, 'query')
+                    self.assertEquals(''.join(shards), entries.to_str() + '\n')
+                    self.assertEquals([len(fasta.entries(shard)) for shard in shards],
+                                      [len(shard) for shard in entries.split(array_size)])
+
+    def test_streamed_shards_equal_listed_shards(self):
+        entries = self.entries(45)
+        path = os.path.join(self.tmpdir, 'upload.fasta')
+        with open(path, 'w') as f:
+            entries.write_to(f)
+        with self.settings(JOB_ARRAY_MIN_SHARD_SEQUENCES=10, JOB_ARRAY_MAX_SHARDS=4):
+            listed = MDRScanJob()
+            listed.write_sharded_workfile('query', entries)
+            streamed = MDRScanJob()
+            streamed.write_sharded_workfile('query', fasta.FastaFile(path, len(entries), entries.count_residues()))
+        self.assertEquals(streamed.array_size, 4)
+        self.assertEquals(self.read_shards(streamed, 'query'), self.read_shards(listed, 'query'))
+
+    def write_shards(self, job, path, texts):
+        for i, text in enumerate(texts):
+            job.write_workfile(job.shard_name(path, i), text)
+
+    def test_mdrscan_merge(self):
+        job = MDRScanJob(array_size=2)
+        self.write_shards(job, 'hmmpfam', ['a\n', 'b\n'])
+        self.write_shards(job, 'json', [json.dumps(dict(format='f', results=dict(strong_hits=[1], weak_hits=[]))),
+                                        json.dumps(dict(format='f', results=dict(strong_hits=[2], weak_hits=[3])))])
+        job.merge_shards()
+        self.assertEquals(job.open_workfile('hmmpfam').read(), 'a\nb\n')
+        info = json.load(job.open_workfile('json'))
+        self.assertEquals(info, dict(format='f', results=dict(strong_hits=[1, 2], weak_hits=[3])))
+
+    def test_noduleblast_merge(self):
+        job = DatiscaNoduleBlastJob(array_size=2)
+        self.write_shards(job, 'blast', ['a\n', 'b\n'])
+        self.write_shards(job, 'json', [json.dumps(dict(format='f', results=dict(program='blastn', queries=[1]))),
+                                        json.dumps(dict(format='f', results=dict(program='blastn', queries=[2])))])
+        self.write_shards(job, 'hits', ['>x\nAC\n>y\nGT\n', '>y\nGT\n>z\nTT\n'])
+        job.merge_shards()
+        self.assertEquals(job.open_workfile('blast').read(), 'a\nb\n')
+        self.assertEquals(json.load(job.open_workfile('json'))['results']['queries'], [1, 2])
+        # Sequences hit in several shards are only saved once.
+        self.assertEquals([e.id for e in fasta.entries(job.open_workfile('hits'))], ['x', 'y', 'z'])
+
+    def test_merge_is_required_for_job_arrays(self):
+        self.assertRaises(NotImplementedError, Job(array_size=2).merge_shards)
@@ -0,0 +1,194 @@
+"""Bulk job status transitions.
+
+update_status_for_jobs() has the same effect as calling Job.update_status()
+for each job, but keeps the jobs locked only for a short while:
+
+1. The schedulers are asked about all jobs, with no locks held.
+2. on_status_changed() (e.g: saving result files) runs for all changed jobs in
+   a pool of worker threads, still with no locks held.
+3. In one short transaction, the changed jobs are locked and updated with one
+   UPDATE per (old status, new status) group, and all changes are logged with
+   one bulk insert of LogEntry rows.
+4. Job directories are moved or removed in the worker pool, failed jobs are
+   cancelled and the new statuses are published.
+
+Jobs whose status was changed by someone else in the meantime (e.g: deleted
+by their owner) are left alone in step 3.
+"""
+from multiprocessing.pool import ThreadPool
+import logging
+import traceback
+
+from django.conf import settings
+from django.contrib.admin.models import (CHANGE,
+                                         LogEntry)
+from django.contrib.contenttypes.models import ContentType
+from django.db import (connection,
+                       transaction)
+from django.utils.encoding import force_unicode
+
+from agda.utils import ModelDiffer
+from jobs.events import publish_status
+from jobs.models import (JOB_STATUS_LEVEL_DELETED,
+                         JOB_STATUS_LEVEL_FAILED,
+                         Job,
+                         job_status_levels,
+                         schedulers)
+from profiles.models import get_user_or_anonymous
+
+logger = logging.getLogger(__name__)
+
+# Max number of jobs per UPDATE query.
+batch_size = 500
+
+
+class Transition(object):
+    """A status change for a job, as reported by its scheduler."""
+    def __init__(self, job, status, start_date, completion_date):
+        self.job = job
+        self.old_status = job.status
+        self.status = status
+        self.start_date = start_date
+        self.completion_date = completion_date
+        self.reason = job.reason
+
+    def prepare(self):
+        """Call on_status_changed(), and fail the job if it raises."""
+        try:
+            self.job.on_status_changed(self.status)
+        except:
+            self.reason = 'Error during status change to %s.' % job_status_levels[self.status].capitalize()
+            logger.error('Job %s - %s - %s' % (unicode(self.job), self.reason, traceback.format_exc()))
+            self.status = JOB_STATUS_LEVEL_FAILED
+
+    def apply(self):
+        """Set the new values on the job, and return a log message for the change."""
+        diff = ModelDiffer(self.job)
+        self.job.status = self.status
+        self.job.start_date = self.start_date
+        self.job.completion_date = self.completion_date
+        self.job.reason = self.reason
+        diff.update(self.job)
+        return diff.get_change_message()
+
+    def finish(self):
+        """Tidy up job directories and cancel failed jobs."""
+        if self.status < 0 and self.status != JOB_STATUS_LEVEL_DELETED:
+            # The job is no longer alive, so Job.cancel() would do nothing.
+            schedulers[self.job.scheduler].cancel(self.job)
+        self.job.tidy_jobdirs()
+
+
+def in_worker(method):
+    """Call method in a worker thread, and close the thread's db connection."""
+    def call(transition):
+        try:
+            method(transition)
+        except:
+            logger.exception('job %s status transition failed', transition.job)
+        finally:
+            connection.close()
+    return call
+
+
+def get_db_value(field_name, value):
+    return Job._meta.get_field(field_name).get_db_prep_value(value, connection)
+
+
+def update_jobs(status, transitions):
+    """Set status, dates and reasons for the jobs of transitions in one UPDATE."""
+    qn = connection.ops.quote_name
+    id_column = qn(Job._meta.pk.column)
+    assignments = ['%s = %%s' % qn(Job._meta.get_field('status').column)]
+    params = [status]
+    for name in ('start_date', 'completion_date', 'reason'):
+        cases = []
+        for transition in transitions:
+            cases.append('WHEN %s THEN %s')
+            params.extend([transition.job.id, get_db_value(name, getattr(transition, name))])
+        column = qn(Job._meta.get_field(name).column)
+        assignments.append('%s = CASE %s %s END' % (column, id_column, ' '.join(cases)))
+    ids = [transition.job.id for transition in transitions]
+    sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (qn(Job._meta.db_table),
+                                                 ', '.join(assignments),
+                                                 id_column,
+                                                 ', '.join(['%s'] * len(ids)))
+    connection.cursor().execute(sql, params + ids)
+
+
+def apply_transitions(user, transitions):
+    """Lock, update and log the jobs of transitions in one transaction.
+
+    Returns
+    -------
+    The transitions that were applied, i.e. those of jobs that still had
+    their old status.
+    """
+    groups = dict()
+    for transition in transitions:
+        groups.setdefault((transition.old_status, transition.status), []).append(transition)
+    applied = []
+    with transaction.atomic():
+        for (old_status, status), group in groups.items():
+            for i in range(0, len(group), batch_size):
+                batch = dict((t.job.id, t) for t in group[i:i + batch_size])
+                locked = (Job.objects.select_for_update()
+                          .filter(id__in=batch.keys(), status=old_status)
+                          .values_list('id', flat=True))
+                batch = [batch[id] for id in locked]
+                if batch:
+                    update_jobs(status, batch)
+                    applied.extend(batch)
+        user = get_user_or_anonymous(user)
+        entries = []
+        for transition in applied:
+            job = transition.job
+            entries.append(LogEntry(user_id=user.pk,
+                                    content_type_id=ContentType.objects.get_for_model(job).pk,
+                                    object_id=job.pk,
+                                    object_repr=force_unicode(job)[:200],
+                                    action_flag=CHANGE,
+                                    change_message=transition.apply()))
+        LogEntry.objects.bulk_create(entries)
+    return applied
+
+
+def update_status_for_jobs(user, jobs, workers=None):
+    """Update status for multiple jobs, see the module docstring.
+
+    Aggregates jobs with same scheduler and uses .get_job_states(), in order to
+    reduce overhead from communication with schedulers.
+
+    Parameters
+    ----------
+    user : the user to log the changes for.
+    jobs : an iterable of jobs in their proper subclasses, e.g. get_live_jobs().
+    workers : number of threads for file system work, default settings.JOB_STATUS_WORKERS.
+    """
+    sched = dict()
+    for job in jobs:
+        sched.setdefault(schedulers[job.scheduler], []).append(job)
+    transitions = []
+    for scheduler, scheduler_jobs in sched.items():
+        for job, (status, start_date, completion_date) in scheduler.get_job_states(scheduler_jobs):
+            if status != job.status:
+                transitions.append(Transition(job, status, start_date, completion_date))
+    if not transitions:
+        return []
+    pool = ThreadPool(workers or settings.JOB_STATUS_WORKERS)
+    try:
+        pool.map(in_worker(Transition.prepare), transitions)
+        applied = apply_transitions(user, transitions)
+        pool.map(in_worker(Transition.finish), applied)
+    finally:
+        pool.close()
+        pool.join()
+    skipped = set(t.job.id for t in transitions).difference(t.job.id for t in applied)
+    if skipped:
+        # Jobs deleted in the meantime may have had result files saved above.
+        for job in Job.objects.filter(id__in=skipped, status=JOB_STATUS_LEVEL_DELETED):
+            job.remove_jobdir('results')
+    for transition in applied:
+        publish_status(transition.job)
+    logger.info('updated status for %s of %s changed jobs.', len(applied), len(transitions))
+    return applied
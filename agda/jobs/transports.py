@@ -0,0 +1,383 @@
+"""Transports that carry scheduler requests to Slurm.
+
+A transport does the actual talking to Slurm on behalf of the Slurm scheduler
+in jobs.models, which deals with jobs, workdirs and job status levels. Two
+transports are available:
+
+- SlurmCommandTransport runs sbatch, scancel, sacct and squeue in a
+  subprocess, i.e. one fork+exec per call.
+- SlurmRestTransport sends JSON requests to slurmrestd (or any server that
+  speaks the same protocol, e.g. a fake one in tests) over persistent
+  keep-alive HTTP connections, i.e. no forks at all.
+
+Use settings.SLURM_TRANSPORT to pick one.
+"""
+from datetime import datetime
+import httplib
+import json
+import logging
+import os
+import subprocess
+import threading
+import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def call(argv):
+    p = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = p.communicate()
+    if p.returncode != 0:
+        raise ValueError('%s command failed: %s, stdout: %s, stderr: %s' % (argv[0], argv, output, errors))
+    return output
+
+
+class SchedulerBusy(Exception):
+    """Raised when the scheduler temporarily refuses to accept more jobs.
+
+    Submissions that fail this way should be retried later.
+    """
+
+
+class SlurmTransport(object):
+    """Carry submit/cancel/status requests to Slurm.
+
+    Job states are returned as slurm id: (state, start, end) dicts, with
+    state being a slurm state name or code, and start and end being times in
+    time_format, or any other string (e.g: "Unknown") if not set.
+
+    Submit raises SchedulerBusy if slurm rejects the job with any of the
+    busy_messages.
+    """
+    time_format = "%Y-%m-%dT%H:%M:%S"
+    busy_messages = ('temporarily unable to accept job',
+                     'Resource temporarily unavailable',
+                     'Socket timed out',
+                     'MaxSubmitJob')
+
+    def is_busy(self, error_message):
+        return any(m in error_message for m in self.busy_messages)
+
+    def submit(self, job_script, job_args, options, slurm_args=[]):
+        """Submit job_script and return the slurm job id as a str.
+
+        options is a dict with the keys workdir, stdout, stderr, stdin
+        (None if unused), nodes, tasks and time (minutes), and optionally
+        cpus, the number of cpus per task, and array, a job array index
+        specification like "0-15". slurm_args is a list of extra sbatch
+        command line arguments.
+        """
+        raise NotImplementedError
+
+    def cancel(self, scheduler_id):
+        """Cancel the slurm job with the given id."""
+        raise NotImplementedError
+
+    def job_states(self, ids):
+        """Return a slurm id: (state, start, end) dict for the given ids.
+
+        Job array tasks are reported as <array job id>_<task id> (e.g:
+        "1234_7" or "1234_[8-15]" for pending tasks) instead of by array job
+        id. Jobs slurm has no record of are not present in the returned dict.
+        """
+        raise NotImplementedError
+
+
+def get_array_job_id(id):
+    """The array job id part of a job array task id, or id itself for ordinary jobs."""
+    return id.split('_')[0]
+
+
+class SlurmCommandTransport(SlurmTransport):
+    """Talk to slurm by running its command line tools."""
+
+    # Job ids per sacct/squeue call, to stay well within argv length limits.
+    max_ids_per_call = 1000
+
+    def submit(self, job_script, job_args, options, slurm_args=[]):
+        argv = ['sbatch',
+                '-D', options['workdir'],
+                '-o', options['stdout'],
+                '-e', options['stderr'],
+                '-N', str(options['nodes']),
+                '-n', str(options['tasks']),
+                '-t', str(options['time'])]
+        if options.get('stdin') is not None:
+            argv.extend(['-i', options['stdin']])
+        if options.get('cpus') is not None:
+            argv.extend(['-c', str(options['cpus'])])
+        if options.get('array') is not None:
+            argv.extend(['-a', options['array']])
+        argv.extend(slurm_args)
+        argv.append(job_script)
+        argv.extend(job_args)
+        try:
+            output = call(argv)
+        except ValueError, e:
+            if self.is_busy(str(e)):
+                raise SchedulerBusy(str(e))
+            raise
+        # sbatch should return e.g. "Submitted batch job 525112", fail if incomprehensible.
+        return str(int(output.split()[-1]))
+
+    def cancel(self, scheduler_id):
+        call(['scancel', scheduler_id])
+
+    def id_chunks(self, ids):
+        """Split ids into comma separated lists short enough for one argv."""
+        ids = list(ids)
+        for i in range(0, len(ids), self.max_ids_per_call):
+            yield ','.join(ids[i:i + self.max_ids_per_call])
+
+    def query_sacct(self, ids):
+        """Return a slurm id: (state, start, end) dict from the accounting db.
+
+        Costs one sacct call per max_ids_per_call ids. Jobs that accounting
+        does not know (yet) are not present in the returned dict.
+        """
+        raw_states = dict()
+        for chunk in self.id_chunks(ids):
+            argv = ['sacct', '-n', '-X', '--parsable2',
+                    '--format=JobID,State,Start,End', '-j', chunk]
+            for line in call(argv).splitlines():
+                words = line.strip().split('|')
+                if len(words) < 4:
+                    continue
+                # e.g: "CANCELLED by 1234"
+                state = words[1].split()[0]
+                raw_states[words[0]] = (state, words[2], words[3])
+        return raw_states
+
+    def query_squeue(self, ids):
+        """Return a slurm id: (state, start, end) dict from the slurm queue.
+
+        Costs one squeue call per max_ids_per_call ids. Slurm drops jobs from
+        the queue MinJobAge seconds after they end, and those jobs are not
+        present in the returned dict.
+        """
+        raw_states = dict()
+        for chunk in self.id_chunks(ids):
+            argv = ['squeue', '-t', 'all', '-ho', '%i %t %S %e', '-j', chunk]
+            try:
+                output = call(argv)
+            except ValueError:
+                # squeue fails if none of the ids are in the queue anymore.
+                logger.warning('squeue found none of slurm jobs %s.', chunk)
+                continue
+            for line in output.splitlines():
+                words = line.split()
+                if len(words) < 4:
+                    continue
+                raw_states[words[0]] = tuple(words[1:4])
+        return raw_states
+
+    def job_states(self, ids):
+        """Look ids up in bulk, first using sacct and then squeue for any
+        jobs that accounting does not know about.
+
+        This costs O(1) forks per max_ids_per_call jobs.
+        """
+        ids = list(ids)
+        raw_states = self.query_sacct(ids)
+        found = set(get_array_job_id(id) for id in raw_states)
+        missing = [id for id in ids if id not in found]
+        if missing:
+            raw_states.update(self.query_squeue(missing))
+        return raw_states
+
+
+class SlurmRestError(Exception):
+    """Raised when slurmrestd rejects a request."""
+    def __init__(self, method, path, status, errors):
+        self.method = method
+        self.path = path
+        self.status = status
+        self.errors = errors
+
+    def __str__(self):
+        return '%s %s failed with status %s: %s' % (self.method, self.path, self.status, self.errors)
+
+
+class SlurmRestTransport(SlurmTransport):
+    """Talk to slurm through the slurmrestd JSON api.
+
+    Connections are kept alive and reused, one per thread, so a request costs
+    one round trip and no process creation.
+
+    Jobs run with environment, a dict, or like with sbatch, with the
+    environment of the submitting process if it is None.
+    """
+    idempotent_methods = ('GET', 'DELETE')
+
+    def __init__(self, url, user=None, token=None, version='v0.0.39', timeout=30, environment=None):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.user = user
+        self.token = token
+        self.version = version
+        self.timeout = timeout
+        self.environment = environment
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection_class = httplib.HTTPSConnection if self.scheme == 'https' else httplib.HTTPConnection
+            connection = connection_class(self.netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def request(self, method, path, data=None):
+        """Send a JSON request and return the decoded JSON response body.
+
+        A request on a connection that the server has closed since the last
+        request is retried once on a fresh connection. Requests that are not
+        idempotent, e.g: job submissions, are only retried if sending them
+        failed, so that slurm never gets them twice.
+        """
+        path = self.prefix + path
+        body = None if data is None else json.dumps(data)
+        headers = {'Accept': 'application/json',
+                   'Connection': 'keep-alive'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        if self.user:
+            headers['X-SLURM-USER-NAME'] = self.user
+        if self.token:
+            headers['X-SLURM-USER-TOKEN'] = self.token
+        for retry in (True, False):
+            sent = False
+            try:
+                self.connection.request(method, path, body, headers)
+                sent = True
+                response = self.connection.getresponse()
+                text = response.read()
+                break
+            except (httplib.HTTPException, IOError):
+                self.close()
+                if not retry or (sent and method not in self.idempotent_methods):
+                    raise
+        if response.getheader('connection', '').lower() == 'close':
+            self.close()
+        result = json.loads(text) if text else dict()
+        if response.status >= 400 or result.get('errors'):
+            raise SlurmRestError(method, path, response.status, result.get('errors'))
+        return result
+
+    def get_job_environment(self):
+        """The job environment as a list of NAME=value strs."""
+        environment = os.environ if self.environment is None else self.environment
+        return ['%s=%s' % item for item in sorted(environment.items())]
+
+    def submit(self, job_script, job_args, options, slurm_args=[]):
+        if slurm_args:
+            raise ValueError('extra sbatch arguments are not supported by the slurmrestd transport')
+        job = dict(current_working_directory=options['workdir'],
+                   standard_output=options['stdout'],
+                   standard_error=options['stderr'],
+                   nodes=str(options['nodes']),
+                   tasks=options['tasks'],
+                   time_limit=dict(number=options['time'], set=True),
+                   argv=[job_script] + list(job_args),
+                   environment=self.get_job_environment())
+        if options.get('stdin') is not None:
+            job['standard_input'] = options['stdin']
+        if options.get('cpus') is not None:
+            job['cpus_per_task'] = options['cpus']
+        if options.get('array') is not None:
+            job['array'] = options['array']
+        data = dict(script=open(job_script).read(), job=job)
+        try:
+            result = self.request('POST', '/slurm/%s/job/submit' % self.version, data)
+        except SlurmRestError, e:
+            if e.status in (429, 503) or self.is_busy(str(e)):
+                raise SchedulerBusy(str(e))
+            raise
+        return str(int(result['job_id']))
+
+    def cancel(self, scheduler_id):
+        self.request('DELETE', '/slurm/%s/job/%s' % (self.version, scheduler_id))
+
+    def format_number(self, value):
+        """Unwrap a slurmrestd {set, number} value, None if not set."""
+        if isinstance(value, dict):
+            if not value.get('set', True):
+                return None
+            value = value.get('number')
+        return value
+
+    def format_time(self, value):
+        """Convert a slurmrestd timestamp to a time_format str."""
+        value = self.format_number(value)
+        if not value:
+            return 'Unknown'
+        return datetime.fromtimestamp(value).strftime(self.time_format)
+
+    def format_id(self, job):
+        """The slurm id of a slurmrestd job, as reported by sacct and squeue.
+
+        Handles both slurm (array_job_id, array_task_id) and slurmdb (array)
+        style job array task info.
+        """
+        array = job.get('array', {})
+        array_job_id = self.format_number(job.get('array_job_id', array.get('job_id')))
+        if not array_job_id:
+            return str(job['job_id'])
+        task_id = self.format_number(job.get('array_task_id', array.get('task_id')))
+        if task_id is None:
+            task_id = '[%s]' % job.get('array_task_string', array.get('task', ''))
+        return '%s_%s' % (array_job_id, task_id)
+
+    def format_state(self, value):
+        """Convert a slurmrestd job state to a slurm state name."""
+        if isinstance(value, dict):
+            value = value.get('current')
+        if isinstance(value, list):
+            value = value[0]
+        return str(value)
+
+    def job_states(self, ids):
+        """Get all jobs in the queue in one request, and then ask accounting
+        about each remaining job on the same connection.
+        """
+        ids = set(ids)
+        raw_states = dict()
+        for job in self.request('GET', '/slurm/%s/jobs' % self.version).get('jobs', []):
+            id = self.format_id(job)
+            if get_array_job_id(id) in ids:
+                raw_states[id] = (self.format_state(job['job_state']),
+                                  self.format_time(job.get('start_time')),
+                                  self.format_time(job.get('end_time')))
+        for id in ids.difference(get_array_job_id(id) for id in raw_states):
+            try:
+                jobs = self.request('GET', '/slurmdb/%s/job/%s' % (self.version, id)).get('jobs', [])
+            except SlurmRestError:
+                continue
+            for job in jobs:
+                time = job.get('time', {})
+                raw_states[self.format_id(job)] = (self.format_state(job['state']),
+                                                   self.format_time(time.get('start')),
+                                                   self.format_time(time.get('end')))
+        return raw_states
+
+
+def get_slurm_transport(settings):
+    """Create the slurm transport configured in settings.SLURM_TRANSPORT."""
+    if settings.SLURM_TRANSPORT == 'command':
+        return SlurmCommandTransport()
+    if settings.SLURM_TRANSPORT == 'rest':
+        return SlurmRestTransport(settings.SLURMRESTD_URL,
+                                  user=settings.SLURMRESTD_USER,
+                                  token=settings.SLURMRESTD_TOKEN,
+                                  version=settings.SLURMRESTD_VERSION,
+                                  environment=settings.SLURMRESTD_JOB_ENVIRONMENT)
+    raise ValueError('no such slurm transport: %r' % settings.SLURM_TRANSPORT)
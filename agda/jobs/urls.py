@@ -6,6 +6,7 @@ urlpatterns = patterns('jobs.views',
     (r'^$', 'list_jobs'),
     (r'^delete/$', 'delete_jobs'),
     (r'^(%s)/$' % Slug.regex, 'show_results'),
+    (r'^(%s)/status/$' % Slug.regex, 'wait_for_status'),
     (r'^(%s)/delete/$' % Slug.regex, 'delete_job'),
     (r'^(%s)/rename/$' % Slug.regex, 'rename_job'),
     (r'^(%s)/take/$' % Slug.regex, 'take_job'),
@@ -1,58 +1,78 @@
-import time
-
 from django import forms
+from django.conf import settings
 from django.db import transaction
 from django.shortcuts import (render, redirect)
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import Http404
+from django.views.decorators.cache import never_cache
 from agda.forms import get_form
 
+from jobs.events import wait_for_status_change
 from jobs.models import (JOB_STATUS_LEVEL_DELETED,
-                         JOB_STATUS_LEVEL_FINISHED,
-                         JOB_STATUS_LEVEL_ACCEPTED,
                          Job,
                          get_job_or_404,
-                         update_status_for_jobs,)
+                         get_jobs_page,
+                         job_status_levels)
+
 
+from agda.views import require_nothing, package_template_dict, json_response
 
-from agda.views import require_nothing, package_template_dict
+
+def get_page_args(request):
+    """Parse the after and limit GET parameters for get_jobs_page()."""
+    try:
+        after = request.GET.get('after')
+        after = int(after) if after else None
+        limit = int(request.GET.get('limit', settings.JOB_LIST_PAGE_SIZE))
+    except ValueError:
+        raise Http404('No such page')
+    return after, max(1, min(limit, settings.JOB_LIST_MAX_PAGE_SIZE))
 
 
 @login_required
 def list_jobs(request):
-    alive = (Job.objects.select_subclasses()
-                .filter(user=request.user)
-                .filter(status__gte=JOB_STATUS_LEVEL_ACCEPTED)
-                .filter(status__lt=JOB_STATUS_LEVEL_FINISHED))
-    update_status_for_jobs(request.user, alive)
-    jobs = Job.objects.filter(user=request.user)\
-              .exclude(status=JOB_STATUS_LEVEL_DELETED)\
-              .order_by('-submission_date').select_subclasses()
-    return render(request, 'agda/job/list.html', dict(jobs=jobs))
+    # Job status is kept up to date by the job_status_daemon command.
+    after, limit = get_page_args(request)
+    jobs, next = get_jobs_page(request.user, after, limit)
+    return render(request, 'agda/job/list.html', dict(jobs=jobs, next=next, limit=limit))
 
 
 def generic_show_results(request, job):
+    # Pages for live jobs wait for status changes using wait_for_status.
     params = package_template_dict(request, package=job.tool.package, tool=job.tool, job=job)
-    if job.is_alive:
-        session_key = job.tool.name + '.generic_results.timeout'
-        reload_time, interval = request.session.setdefault(session_key, dict()).pop(job.slug, (0, 5))
-        if reload_time <= time.time():
-            reload_time = max(time.time() + 5, reload_time + interval)
-            interval *= 2
-        request.session[session_key][job.slug] = (reload_time, interval)
-        request.session.modified = True
-        params.update(timeout=reload_time - time.time())
-        params.update(reload_time=reload_time, interval=interval)
     return render(request, 'agda/job/results.html', params)
 
 
+@never_cache
+@require_nothing
+def wait_for_status(request, slug):
+    """Long-poll for job status changes.
+
+    Responds as soon as the job status differs from the status GET parameter
+    (the one the client knows about), or with the unchanged status after
+    settings.JOB_STATUS_WAIT_TIMEOUT seconds, whichever comes first. Waiting
+    clients cost no database queries, see jobs.events.
+    """
+    job = get_job_or_404(slug=slug)
+    try:
+        status = int(request.GET.get('status', job.status))
+    except ValueError:
+        return json_response(dict(error='status must be an integer'), status=400)
+    new_status = wait_for_status_change(job, status,
+                                        settings.JOB_STATUS_WAIT_TIMEOUT,
+                                        settings.JOB_STATUS_WAIT_POLL_INTERVAL)
+    if new_status is None:
+        new_status = status
+    return json_response(dict(job=job.slug,
+                              status=new_status,
+                              status_name=job_status_levels[new_status].capitalize(),
+                              changed=new_status != status))
+
+
 @require_nothing
 def show_results(request, slug):
-    job = get_job_or_404(slug=slug, select_for_update=True)
-    job.update_status(request.user)
-    if job.status == JOB_STATUS_LEVEL_DELETED:
-        raise Http404('no such job, you friggin')
+    job = get_job_or_404(slug=slug)
     module, view = job.tool.results_view.rsplit('.', 1)
     tmp = __import__(module, globals(), locals(), [view])
     return getattr(tmp, view)(request, slug)
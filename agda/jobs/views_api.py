@@ -1,5 +1,6 @@
 import json
 import os
+from urllib import urlencode
 
 from django.core.urlresolvers import reverse
 from django.db import transaction
@@ -7,15 +8,15 @@ from django.http import Http404, HttpResponse
 
 from jobs.models import (JOB_STATUS_LEVEL_DELETED,
                          JOB_STATUS_LEVEL_FINISHED,
-                         JOB_STATUS_LEVEL_ACCEPTED,
                          Job,
                          get_job_or_404,
-                         update_status_for_jobs,)
+                         get_jobs_page)
+from jobs.views import get_page_args
 
 from agda.utils import model_dict
 
 from agda.views import (require_nothing, api_require_nothing, json_response,
-                        json_datetime_encoder)
+                        json_stream_response, json_datetime_encoder)
 
 
 def api_generic_show_results(request, job):
@@ -29,31 +30,31 @@ def api_generic_show_results(request, job):
 
 
 def api_list_jobs(request):
+    """List one page of jobs, newest first.
+
+    Use the after and limit GET parameters to page through the list. The url
+    of the next page, if any, is given in a Link header with rel="next".
+    """
     user = request.agda_api_user
-    alive = (Job.objects.select_subclasses()
-                .filter(user=user)
-                .filter(status__gte=JOB_STATUS_LEVEL_ACCEPTED)
-                .filter(status__lt=JOB_STATUS_LEVEL_FINISHED))
-    update_status_for_jobs(user, alive)
-    jobs = (Job.objects.select_subclasses()
-            .filter(user=user)
-            .exclude(status=JOB_STATUS_LEVEL_DELETED)
-            .order_by('-submission_date'))
+    # Job status is kept up to date by the job_status_daemon command.
+    after, limit = get_page_args(request)
+    jobs, next = get_jobs_page(user, after, limit)
 
     def job_info(job):
         info = model_dict(job, ['id', 'status', 'status_name', 'submission_date', 'start_date', 'completion_date'])
         info['results'] = request.build_absolute_uri(reverse(api_show_results, args=[job.slug]))
         info['tool'] = job.tool.displayname
         return info
-    return json_response([job_info(j) for j in jobs], default=json_datetime_encoder)
+    response = json_stream_response((job_info(j) for j in jobs), default=json_datetime_encoder)
+    if next is not None:
+        url = request.build_absolute_uri(reverse(api_list_jobs)) + '?' + urlencode(dict(after=next, limit=limit))
+        response['Link'] = '<%s>; rel="next"' % url
+    return response
 
 
 @api_require_nothing
 def api_show_results(request, slug):
-    job = get_job_or_404(slug=slug, select_for_update=True)
-    job.update_status(request.user)
-    if job.status == JOB_STATUS_LEVEL_DELETED:
-        raise Http404('no such job')
+    job = get_job_or_404(slug=slug)
     module, view = job.tool.api_results_view.rsplit('.', 1)
     tmp = __import__(module, globals(), locals(), [view])
     return getattr(tmp, view)(request, slug)
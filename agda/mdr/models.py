@@ -4,11 +4,14 @@ import shutil
 
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import (post_delete,
+                                      post_save)
 from django.template.loader import render_to_string
 
 
 from agda.models import Package
-from agda.query import MySQLFulltextSearchQuerySet
+from agda.query import FulltextSearchQuerySet
+from agda.utils import model_dict
 from jobs.models import Job, slurm
 
 import parse_mdrscan
@@ -57,12 +60,16 @@ class MDRScanJob(Job):
         )
 
     def on_submit(self, entries):
-        self.statistics = json.dumps(dict(sequences=len(entries), residues=sum(len(e) for e in entries)))
-        self.write_workfile('query', entries.to_str())
+        self.statistics = json.dumps(dict(sequences=len(entries), residues=entries.count_residues()))
+        self.write_sharded_workfile('query', entries)
         script = 'mdrscan.sh'
-        db = os.path.join(settings.DATA_ROOT, 'pub', 'mdr', '2010.1', 'mdr.pfam.gz')
-        self.write_workfile(script, render_to_string('mdr/mdrscan.sh', dict(db=db)))
-        self.write_workfile('family_data.json', parse_mdrscan.FamilyData.dumps(Family.objects.all()))
+        db = os.path.join(settings.DATA_ROOT, 'pub', 'mdr', settings.MDR_RELEASE, 'mdr.pfam.gz')
+        params = dict(db=db,
+                      query=self.task_name('query'),
+                      hmmpfam=self.task_name('hmmpfam'),
+                      json=self.task_name('json'))
+        self.write_workfile(script, render_to_string('mdr/mdrscan.sh', params))
+        self.write_workfile('family_data.json', parse_mdrscan.FamilyData.dumps(family_registry.all()))
         shutil.copy(parse_mdrscan.__file__.rstrip('oc'), self.workdir)
 
         ## Copy the care/fasta.py thingy TODO fix this
@@ -71,7 +78,17 @@ class MDRScanJob(Job):
         self.write_workfile('core/__init__.py', "")
 
         self.result_files = self.files
-        slurm.submit(self, self.workfile(script))
+        slurm.submit(self, self.workfile(script), array=self.array_size)
+
+    def merge_shards(self):
+        self.concatenate_shards('hmmpfam')
+        results = dict(strong_hits=[], weak_hits=[])
+        for shard in self.open_shards('json'):
+            info = json.load(shard)
+            for confidence in results:
+                results[confidence].extend(info['results'][confidence])
+        info['results'] = results
+        self.write_workfile('json', json.dumps(info))
 
 
 class Family(models.Model):
@@ -111,6 +128,56 @@ class Family(models.Model):
         return self.id
 
 
+class FamilyRegistry(object):
+    """All MDR families, loaded from the database once per process.
+
+    The Family table is small and only changes when MDR data is imported.
+    Saving or deleting a Family, e.g: with loaddata, clears the registry of
+    the current process. Other processes must be restarted after an import.
+    """
+    def __init__(self):
+        self._families = None
+
+    def clear(self, **kw):
+        self._families = None
+
+    @property
+    def families(self):
+        """An id: (Family, model_dict(Family)) dict of all families."""
+        families = self._families
+        if families is None:
+            families = dict((f.id, (f, model_dict(f))) for f in Family.objects.all())
+            self._families = families
+        return families
+
+    def __len__(self):
+        return len(self.families)
+
+    def __contains__(self, id):
+        return id in self.families
+
+    def get(self, id):
+        """Return the Family with the given id, or raise Family.DoesNotExist."""
+        try:
+            return self.families[id][0]
+        except KeyError:
+            raise Family.DoesNotExist('no such family: %s' % id)
+
+    def get_dict(self, id):
+        """Return a new model_dict() of the Family with the given id, or raise Family.DoesNotExist."""
+        try:
+            return dict(self.families[id][1])
+        except KeyError:
+            raise Family.DoesNotExist('no such family: %s' % id)
+
+    def all(self):
+        return [family for family, family_dict in self.families.values()]
+
+family_registry = FamilyRegistry()
+post_save.connect(family_registry.clear, sender=Family, weak=False)
+post_delete.connect(family_registry.clear, sender=Family, weak=False)
+
+
 class Member(models.Model):
     family_id = models.CharField(max_length=10)
     rank = models.IntegerField()
@@ -129,7 +196,7 @@ class Member(models.Model):
     description = models.TextField(blank=True, null=True)
     comment = models.TextField(blank=True, null=True)
 
-    objects = MySQLFulltextSearchQuerySet.as_manager()
+    objects = FulltextSearchQuerySet.as_manager()
     fulltext_indexes = dict(description=(description,),
                             default=(family_id,
                                      family_name,
@@ -140,6 +207,12 @@ class Member(models.Model):
                                      species_common_name,
                                      description,
                                      comment))
+    # See agda.query.LocalSearchIndex.
+    wildcard_indexes = (family_name,
+                        uniprot_ac,
+                        uniprot_id,
+                        species,
+                        species_common_name)
 
     def __str__(self):
         return "%s - %s" % (self.family_id, self.rank)
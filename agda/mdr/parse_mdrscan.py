@@ -28,8 +28,9 @@ def parse_mdrscan(hmmpfam_file, query, family_data):
     if isinstance(hmmpfam_file, basestring):
         hmmpfam_file = open(hmmpfam_file)
     if isinstance(query, basestring):
-        query = open(query)
-    queries = fasta.FastaDict.from_text(query)
+        query_lengths = dict(fasta.parse_path(query, lengths_only=True))
+    else:
+        query_lengths = dict((q.id, len(q)) for q in fasta.FastaDict.from_text(query).values())
     results = dict(strong_hits=[], weak_hits=[])
 
     def _add_hit(family_list, family, hit):
@@ -69,7 +70,7 @@ def parse_mdrscan(hmmpfam_file, query, family_data):
             query_info = dict(id=query_id,
                               families=[],
                               description='',
-                              length=len(queries[query_id]))
+                              length=query_lengths[query_id])
             results['strong_hits'].append(query_info)
             results['weak_hits'].append(dict(query_info, families=[]))
         elif line.startswith('Description:'):
@@ -102,6 +103,6 @@ if __name__ == '__main__':
     if len(sys.argv) > 1:
         hmmpfam_file = sys.argv[1]
     family_data = FamilyData.load(open(family_data_file))
-    results = parse_mdrscan(open(hmmpfam_file), open(query_file), family_data)
+    results = parse_mdrscan(open(hmmpfam_file), query_file, family_data)
     info = dict(format=json_format_version, results=results)
     json.dump(info, open(results_file, 'w'))
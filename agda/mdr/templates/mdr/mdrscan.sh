@@ -13,9 +13,9 @@ logg "Preparing MDR HMM database: {{db}}"
 prepare_db {{db}} 
 
 logg "Running hmmpfam..."
-hmmpfam --informat fasta $HMMER_DB_DIR/mdr.pfam query.fasta > mdrscan.hmmpfam
+hmmpfam --informat fasta $HMMER_DB_DIR/mdr.pfam {{query}} > {{hmmpfam}}
 
 logg "Parsing hits..."
-python parse_mdrscan.py
+python parse_mdrscan.py {{hmmpfam}} {{json}} {{query}}
 
 logg "Done."
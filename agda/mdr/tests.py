@@ -5,7 +5,50 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+from StringIO import StringIO
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.test import (RequestFactory,
+                         TestCase)
+
+from agda.forms import (clean_species_code,
+                        clean_wildcard_like)
+from agda.forms.cached_uploads import CachedUpload
+from agda import query
+from agda.query import (LocalSearchIndex,
+                        search_like)
+from core import fasta
+from jobs import models as job_models
+from jobs.models import QueuedSubmission
+from mdr.models import (Family,
+                        MDRScanJob,
+                        Member,
+                        family_registry)
+from mdr.views import (api_family_lookup,
+                       api_search,
+                       get_family_page,
+                       to_mdr_family_id)
+
+
+def create_family(id):
+    fields = dict((f.name, 0) for f in Family._meta.fields if f.get_internal_type() in ('IntegerField', 'FloatField', 'BooleanField'))
+    return Family.objects.create(id=id, name=id.lower(), representative_id='P00000', **fields)
+
+
+def create_members(descriptions):
+    for i, description in enumerate(descriptions):
+        Member.objects.create(family_id='MDR001', rank=i, family_name='adh', source_database='sp',
+                              uniprot_ac='P%05d' % i, uniprot_id='ADH%s_HUMAN' % i, start=1, stop=10,
+                              score=1, sequence_length=10, species='Homo sapiens', kingdom='E',
+                              taxonomic_division='PRI', description=description)
 
 
 class SimpleTest(TestCase):
@@ -15,6 +58,143 @@ class SimpleTest(TestCase):
         """
         self.failUnlessEqual(1 + 1, 2)
 
+
+class TestScanSubmission(TestCase):
+    query = '>a\nACDE\n>b\nFG\n'
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.addCleanup(job_models.jobdirs.__setitem__, 'work', job_models.jobdirs['work'])
+        job_models.jobdirs['work'] = tmpdir
+        self.addCleanup(setattr, CachedUpload, 'dir', CachedUpload.dir)
+        CachedUpload.dir = tmpdir
+
+    def submit(self, **data):
+        data = dict(dict(name='Scan egg', query=''), **data)
+        response = self.client.post(reverse('mdr.views.scan'), data)
+        self.assertEquals(response.status_code, 302)
+        job = MDRScanJob.objects.get(name='Scan egg')
+        (entries,), kw = QueuedSubmission.objects.get(job=job).arguments
+        return job, entries
+
+    def test_text_query(self):
+        job, entries = self.submit(query=self.query)
+        self.assertTrue(isinstance(entries, fasta.FastaList))
+        self.assertEquals(entries.to_str() + '\n', self.query)
+
+    def test_uploaded_query(self):
+        job, entries = self.submit(query_file=SimpleUploadedFile('query.fasta', self.query))
+        self.assertTrue(isinstance(entries, fasta.FastaFile))
+        self.assertEquals((len(entries), entries.count_residues()), (2, 6))
+        self.assertEquals(entries.path, job.workfile('query'))
+        self.assertEquals(open(entries.path).read(), self.query)
+
+
+class TestFamilyRegistry(TestCase):
+    def test_registry(self):
+        family_registry.clear()
+        self.addCleanup(family_registry.clear)
+        create_family('MDR001')
+        with self.assertNumQueries(1):
+            self.assertEquals(to_mdr_family_id('1'), 'MDR001')
+            self.assertEquals(family_registry.get_dict('MDR001')['name'], 'mdr001')
+            self.assertRaises(ValueError, to_mdr_family_id, 'MDR002')
+            self.assertRaises(Family.DoesNotExist, family_registry.get, 'MDR002')
+        create_family('MDR002')
+        self.assertEquals(to_mdr_family_id('mdr2'), 'MDR002')
+
+
+class TestLocalSearchIndex(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        create_members(['Alcohol dehydrogenase 1A', 'Zinc alcohol dehydrogenase', 'Quinone oxidoreductase'])
+
+    def test_search(self):
+        with self.settings(SEARCH_BACKEND='local', SEARCH_INDEX_ROOT=self.tmpdir):
+            LocalSearchIndex(Member).build()
+            def search(query, index='default'):
+                return sorted(m.rank for m in Member.objects.search(query, index))
+            self.assertEquals(search('alcohol'), [0, 1])
+            self.assertEquals(search('+alcohol -zinc'), [0])
+            self.assertEquals(search('dehydro* quinone', 'description'), [0, 1, 2])
+            self.assertEquals(search('adh2_human'), [2])
+            self.assertEquals(search('-alcohol'), [])
+            members = list(Member.objects.search('zinc alcohol', by_relevance=True))
+            self.assertEquals([m.rank for m in members], [1, 0])
+            self.assertTrue(members[0].relevance > members[1].relevance)
+        with self.settings(SEARCH_BACKEND='local', SEARCH_INDEX_ROOT=self.tmpdir, SEARCH_MAX_RESULTS=1):
+            self.assertEquals(search('zinc alcohol'), [1])
+
+    def test_wildcard_search(self):
+        with self.settings(SEARCH_BACKEND='local', SEARCH_INDEX_ROOT=self.tmpdir):
+            LocalSearchIndex(Member).build()
+            def search(cleaner, field_name, value):
+                return sorted(m.rank for m in cleaner(Member.objects.all(), field_name, value))
+            self.assertEquals(search(clean_wildcard_like, 'uniprot_id', 'adh1*human'), [1])
+            self.assertEquals(search(clean_wildcard_like, 'species', 'sapi "no such"'), [0, 1, 2])
+            self.assertEquals(search(clean_species_code, 'species_code', 'human rat'), [0, 1, 2])
+            self.assertEquals(search(clean_species_code, 'species_code', 'rat'), [])
+        # Too many matches are left to LIKE in the database.
+        with self.settings(SEARCH_BACKEND='local', SEARCH_INDEX_ROOT=self.tmpdir, SEARCH_MAX_RESULTS=2):
+            self.assertEquals(search_like(Member.objects.all(), 'species', ['%sapi%']), None)
+            self.assertEquals([m.rank for m in search_like(Member.objects.all(), 'uniprot_id', ['%adh1%'])], [1])
+            self.assertEquals(search(clean_wildcard_like, 'species', 'sapi'), [0, 1, 2])
+
+    def test_reconnect(self):
+        with self.settings(SEARCH_INDEX_ROOT=self.tmpdir):
+            index = LocalSearchIndex(Member)
+            index.build()
+            db = index.connect()
+            self.assertTrue(index.connect() is db)
+            index.build()
+            os.utime(index.path, (0, 0))
+            self.assertEquals(len(index.search('alcohol')), 2)
+            self.assertRaises(sqlite3.ProgrammingError, db.execute, 'SELECT 1')
+
+    def test_old_sqlite(self):
+        orig_min_version = query.SQLITE_MIN_VERSION
+        query.SQLITE_MIN_VERSION = (999, 0, 0)
+        self.addCleanup(setattr, query, 'SQLITE_MIN_VERSION', orig_min_version)
+        with self.settings(SEARCH_INDEX_ROOT=self.tmpdir):
+            index = LocalSearchIndex(Member)
+            self.assertRaises(ImproperlyConfigured, index.build)
+            self.assertRaises(ImproperlyConfigured, index.connect)
+
+
+class TestFamilyPages(TestCase):
+    def test_cached_lookup(self):
+        family_registry.clear()
+        self.addCleanup(family_registry.clear)
+        create_family('MDR001')
+        create_members(['Alcohol dehydrogenase 1A', 'Zinc alcohol dehydrogenase'])
+        with self.settings(MDR_FAMILY_PAGE_CACHE='default'):
+            page = get_family_page('MDR001')
+            self.assertTrue('ADH1_HUMAN' in page['html'])
+            with self.assertNumQueries(0):
+                self.assertEquals(get_family_page('MDR001'), page)
+            request = RequestFactory().post('/api/mdr/family/', '{"id": "1"}', content_type='application/json',
+                                            HTTP_ACCEPT_ENCODING='gzip, deflate')
+            response = api_family_lookup(request)
+            self.assertEquals(response['Content-Encoding'], 'gzip')
+            family = json.loads(gzip.GzipFile(fileobj=StringIO(response.content)).read())
+            self.assertEquals([m['rank'] for m in family['members']], [0, 1])
+
+    def test_streamed_search(self):
+        family_registry.clear()
+        self.addCleanup(family_registry.clear)
+        create_family('MDR001')
+        create_members(['Alcohol dehydrogenase 1A', 'Zinc alcohol dehydrogenase'])
+        request = RequestFactory().post('/api/mdr/search/', '{"uniprot_id": "adh*human"}', content_type='application/json')
+        response = api_search(request)
+        families = json.loads(''.join(response.streaming_content))
+        self.assertEquals(families.keys(), ['MDR001'])
+        self.assertEquals([m['source_database'] for m in families['MDR001']['members']], ['Swiss-Prot'] * 2)
+        # Members of unknown families fail before anything is streamed.
+        Member.objects.filter(rank=1).update(family_id='MDR002')
+        self.assertRaises(Family.DoesNotExist, api_search, request)
+
 __test__ = {"doctest": """
 Another way to test that 1 + 1 is equal to 2.
 
@@ -1,17 +1,23 @@
+import hashlib
+from itertools import groupby
 import json
-import time
+from operator import itemgetter
 
 from django import forms
+from django.conf import settings
+from django.core.cache import get_cache
 from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.db import transaction
 from django.http import (Http404,
                          HttpResponse, StreamingHttpResponse)
-from django.shortcuts import (get_object_or_404,
-                              redirect,
+from django.shortcuts import (redirect,
                               render)
+from django.middleware.gzip import re_accepts_gzip
 from django.template import RequestContext
-from django.utils.text import get_text_list
+from django.utils.cache import patch_vary_headers
+from django.utils.text import (compress_string,
+                               get_text_list)
 
 from agda.forms import (CleanFulltext,
                         DynamicSearchForm,
@@ -29,11 +35,13 @@ from agda.forms import (CleanFulltext,
                         range_help,
                         wildcard_like_help)
 from agda.forms.cached_uploads import CachedUploadManager
+from core import fasta
 
 from agda.settings.local import SITE_ROOT
-from agda.utils import (abspath,
-                        model_dict)
-from agda.views import (json_response,
+from agda.utils import abspath
+from agda.views import (JSONObject,
+                        json_response,
+                        json_stream_response,
                         package_template_dict,
                         render_and_split,
                         script_data,
@@ -48,6 +56,7 @@ from jobs.models import (JOB_STATUS_LEVEL_ACCEPTED,
 from models import (Family,
                     MDRScanJob,
                     Member,
+                    family_registry,
                     mdr_package,
                     mdrlookup_tool,
                     mdrscan_tool,
@@ -77,7 +86,8 @@ def top(request):
 
 ### Scan ###
 
-clean_fasta = FastaCleaner(default_id='query_sequence', min_sequences=0).clean
+fasta_cleaner = FastaCleaner(default_id='query_sequence', min_sequences=0)
+clean_fasta = fasta_cleaner.clean
 
 
 class MDRScanForm(forms.Form):
@@ -92,11 +102,8 @@ class MDRScanForm(forms.Form):
                       name='MDRScan example'),
         advanced=['name'])
 
-    _entries = None
-
     def clean_query(self):
-        self._entries = clean_fasta(self.cleaned_data['query'])
-        return self._entries
+        return clean_fasta(self.cleaned_data['query'])
 
     def clean_query_file(self):
         upload = self.cleaned_data['query_file']
@@ -105,7 +112,8 @@ class MDRScanForm(forms.Form):
             # "keep".  Any initial data is already clean, so let cached_upload
             # sort these out.
             return upload
-        self._entries = clean_fasta(upload)
+        fasta_cleaner.clean_file(upload)
+        upload.seek(0)
         return upload
 
     def clean(self):
@@ -118,12 +126,17 @@ class MDRScanForm(forms.Form):
             self._errors.setdefault('query', []).append('At least one sequence is required.')
         return cleaned_data
 
-    def get_query_entries(self):
+    def get_query_entries(self, job):
+        """Return the query as a FastaList, or for uploads as a fasta.FastaFile
+        streamed straight to the query workfile of job.
+        """
         if not self.is_valid():
             raise KeyError('Cannot get entries from invalid form')
-        if self._entries is not None:
-            return self._entries
-        return self.clean_fasta(self.initial['query_file'].open())
+        if self.cleaned_data['query']:
+            return self.cleaned_data['query']
+        with job.open_workfile('query', 'w') as out:
+            sequences, residues = fasta_cleaner.clean_file(self.initial['query_file'].open(), out)
+        return fasta.FastaFile(job.workfile('query'), sequences, residues)
 
 
 @transaction.atomic
@@ -142,7 +155,7 @@ def api_scan(request):
     job.save()
     job = MDRScanJob.objects.select_for_update().get(pk=job.id)
     job.log_create(request.agda_api_user, 'Created in api.')
-    job.submit(request.agda_api_user, request.META['REMOTE_ADDR'], data.get('name'), entries)
+    job.enqueue(request.agda_api_user, request.META['REMOTE_ADDR'], data.get('name'), entries)
     return redirect(api_show_results, job.slug)
 
 
@@ -160,8 +173,8 @@ def scan(request):
     job.save()
     job = MDRScanJob.objects.select_for_update().get(pk=job.id)
     job.log_create(request.user, 'Created in web interface.')
-    entries = form.get_query_entries()
-    job.submit(request.user, request.META['REMOTE_ADDR'], form.cleaned_data['name'], entries)
+    entries = form.get_query_entries(job)
+    job.enqueue(request.user, request.META['REMOTE_ADDR'], form.cleaned_data['name'], entries)
     cached_uploads.clear_from_session()
     return redirect('jobs.views.show_results', job.slug)
 
@@ -183,8 +196,7 @@ def _scan_results_preprocess(params, results, width):
 
 
 def scan_results(request, slug=None):
-    job = get_job_or_404(slug=slug, select_for_update=True)
-    job.update_status(request.user)
+    job = get_job_or_404(slug=slug)
     params = mdrscan_params(request, job=job)
     if job.status == JOB_STATUS_LEVEL_FINISHED:
         width = 200
@@ -194,15 +206,6 @@ def scan_results(request, slug=None):
         else:
             results = parse_mdrscan.parse_mdrscan(job.resultfile('hmmpfam'), job.resultfile('query'))
         _scan_results_preprocess(params, results, width)
-    elif job.is_alive:
-        reload_time, interval = request.session.setdefault('mdrscan', dict()).pop(job.slug, (0, 5))
-        if reload_time <= time.time():
-            reload_time = max(time.time() + 5, reload_time + interval)
-            interval *= 2
-        request.session['mdrscan'][job.slug] = (reload_time, interval)
-        request.session.modified = True
-        params.update(timeout=reload_time - time.time())
-        params.update(reload_time=reload_time, interval=interval)
     return render(request, 'mdr/scan-results.html', params)
 
 
@@ -215,7 +218,7 @@ def to_mdr_family_id(family_id):
         raise ValueError
     else:
         number = int(family_id[3:].lstrip('0'))
-    if not (1 <= number <= Family.objects.count()):
+    if not (1 <= number <= len(family_registry)):
         raise ValueError
     return 'MDR%03d' % number
 
@@ -263,20 +266,38 @@ search_parameters = (
 )
 
 
+def prepare_member(member):
+    member['source_database'] = 'Swiss-Prot' if member['source_database'] == 'sp' else 'TrEMBL'
+    member['length'] = member['stop'] - member['start'] + 1
+    return member
+
+
 def get_families(member_dicts):
     families = dict()
     for member in member_dicts:
         family = families.get(member['family_id'])
         if not family:
-            family = model_dict(Family.objects.get(pk=member['family_id']))
+            family = family_registry.get_dict(member['family_id'])
             families[member['family_id']] = family
             family['members'] = []
-        member['source_database'] = 'Swiss-Prot' if member['source_database'] == 'sp' else 'TrEMBL'
-        member['length'] = member['stop'] - member['start'] + 1
-        family['members'].append(member)
+        family['members'].append(prepare_member(member))
     return families
 
 
+def iter_families(member_dicts, families):
+    """Like get_families(), but for member dicts ordered by family.
+
+    families is a dict of the family dicts by id, for all members. Yields
+    (family_id, family) pairs, where the members of the family are an
+    iterator over the member dicts, so that they are never all collected in
+    families. Note that MySQLdb still fetches all rows of a query up front.
+    """
+    for family_id, members in groupby(member_dicts, itemgetter('family_id')):
+        family = families[family_id]
+        family['members'] = (prepare_member(member) for member in members)
+        yield family_id, family
+
+
 def api_search(request):
     if request.method == 'GET':
         return json_response({'parameter': 'value', 'parameter...': 'value...'})
@@ -287,8 +308,12 @@ def api_search(request):
     form = DynamicSearchForm(search_parameters, Member, get_dynamic_search_form_data(query), default_cleaner=clean_wildcard_like)
     if not form.is_valid():
         return json_response(dict(complaints=get_parameter_errors(form)), status=422)
-    families = get_families(form.cleaned_data['queryset'].values().iterator())
-    return json_response(families)
+    queryset = form.cleaned_data['queryset']
+    # Unknown families must fail the request before any of it is sent.
+    family_ids = queryset.order_by('family_id').values_list('family_id', flat=True).distinct()
+    families = dict((family_id, family_registry.get_dict(family_id)) for family_id in family_ids)
+    members = queryset.order_by('family_id', 'rank').values().iterator()
+    return json_stream_response(JSONObject(iter_families(members, families)))
 
 
 def render_search_hits(families):
@@ -330,6 +355,47 @@ class LookupForm(forms.Form):
     family_id = forms.CharField(help_text="MDR family ID, on the form MDR001.")
 
 
+family_page_templates = ('mdr/templates/mdr/search-family.html',
+                         'mdr/templates/mdr/search-member-simple.html')
+_family_page_version = None
+
+
+def get_family_page_key(family_id):
+    """Cache key for a family page, for the current MDR release and family page templates."""
+    global _family_page_version
+    if _family_page_version is None:
+        digest = hashlib.md5()
+        for template in family_page_templates:
+            digest.update(open(abspath(SITE_ROOT, template)).read())
+        _family_page_version = digest.hexdigest()[:12]
+    return 'mdr.family_page.%s.%s.%s' % (settings.MDR_RELEASE, _family_page_version, family_id)
+
+
+def render_family_page(family_id):
+    """Render the lookup results of a family and save them in MDR_FAMILY_PAGE_CACHE.
+
+    Returns a dict with the members list html, and the api json both as is
+    and gzipped. Raises Family.DoesNotExist for unknown families.
+    """
+    family = family_registry.get_dict(family_id)
+    family['members'] = list(Member.objects.filter(family_id=family_id).values().iterator())
+    body = json.dumps(family)
+    families = get_families(dict(member) for member in family['members'])
+    page = dict(html=''.join(render_search_hits(families)),
+                json=body,
+                json_gzip=compress_string(body))
+    get_cache(settings.MDR_FAMILY_PAGE_CACHE).set(get_family_page_key(family_id), page, None)
+    return page
+
+
+def get_family_page(family_id):
+    """Return the cached lookup results of a family, see render_family_page()."""
+    page = get_cache(settings.MDR_FAMILY_PAGE_CACHE).get(get_family_page_key(family_id))
+    if page is None:
+        page = render_family_page(family_id)
+    return page
+
+
 def api_family_lookup(request):
     family_id = None
     if request.method == 'GET':
@@ -338,9 +404,17 @@ def api_family_lookup(request):
         family_id = to_mdr_family_id(json.loads(request.body)['id'])
     except:
         raise Http404('no such family')
-    family = model_dict(get_object_or_404(Family, id=family_id))
-    family['members'] = list(Member.objects.filter(family_id=family_id).values().iterator())
-    return json_response(family)
+    try:
+        page = get_family_page(family_id)
+    except Family.DoesNotExist:
+        raise Http404('no such family')
+    if re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(page['json_gzip'], content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(page['json'], content_type='application/json')
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
 
 
 def family_lookup(request, family_id=''):
@@ -357,8 +431,10 @@ def family_lookup(request, family_id=''):
         raise Http404('no such family')
     if original_id != family_id:
         return redirect(family_lookup, family_id)
-    members = Member.objects.filter(family_id=family_id).values().iterator()
-    families = get_families(members)
+    try:
+        page = get_family_page(family_id)
+    except Family.DoesNotExist:
+        raise Http404('no such family')
 
     pre, post = render_and_split('mdr/lookup-results.html', ['hits'], mdrlookup_params(request), RequestContext(request))
-    return StreamingHttpResponse(stream(pre, render_search_hits(families), post))
+    return StreamingHttpResponse(stream(pre, page['html'], post))
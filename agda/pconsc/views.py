@@ -1,10 +1,8 @@
 import os
 import simplejson
-import time
 
 from django import forms
-from django.shortcuts import (Http404,
-                              HttpResponse,
+from django.shortcuts import (HttpResponse,
                               redirect,
                               render)
 from django.db import transaction
@@ -14,7 +12,6 @@ from agda.forms.cached_uploads import (CachedUploadManager)
 from agda.forms import (FormContents,
                         get_form)
 from jobs.models import (JOB_STATUS_LEVEL_ACCEPTED,
-                         JOB_STATUS_LEVEL_DELETED,
                          JOB_STATUS_LEVEL_FINISHED,
                          get_job_or_404)
 from agda.views import json_response, package_template_dict
@@ -110,13 +107,13 @@ def predictall(request):
     job.save()
     job = PredictallJob.objects.select_for_update().get(pk=job.id)
     job.log_create(request.user, 'Created in web interface.')
-    job.submit(request.user,
-               request.META['REMOTE_ADDR'],
-               form.cleaned_data['name'],
-               scheduler,
-               form.get_query_entries(),
-               hhblitsdb,
-               jackhmmerdb)
+    job.enqueue(request.user,
+                request.META['REMOTE_ADDR'],
+                form.cleaned_data['name'],
+                scheduler,
+                form.get_query_entries(),
+                hhblitsdb,
+                jackhmmerdb)
     cached_uploads.clear_from_session()
     return redirect('jobs.views.show_results', job.slug)
 
@@ -137,31 +134,20 @@ def api_predictall(request):
     job = PredictallJob(status=JOB_STATUS_LEVEL_ACCEPTED)
     job.save()
     job.log_create(request.fido_api_user, 'Created in api.')
-    job.submit(request.fido_api_user,
-               request.META['REMOTE_ADDR'],
-               form.cleaned_data['name'],
-               scheduler,
-               form.get_query_entries(),
-               hhblitsdb,
-               jackhmmerdb)
+    job.enqueue(request.fido_api_user,
+                request.META['REMOTE_ADDR'],
+                form.cleaned_data['name'],
+                scheduler,
+                form.get_query_entries(),
+                hhblitsdb,
+                jackhmmerdb)
     return redirect(api_show_results, job.slug)
 
 
 def predictall_results(request, slug):
-    job = get_job_or_404(slug=slug, select_for_update=True)
-    job.update_status(request.user)
-    if job.status == JOB_STATUS_LEVEL_DELETED:
-        raise Http404('no such job')
+    job = get_job_or_404(slug=slug)
     params = predictall_params(request, job=job)
     if job.is_alive:
-        reload_time, interval = request.session.setdefault('pconsc_predictall', dict()).pop(job.slug, (0, 5))
-        if reload_time <= time.time():
-            reload_time = max(time.time() + 5, reload_time + interval)
-            interval *= 2
-        request.session['pconsc_predictall'][job.slug] = (reload_time, interval)
-        request.session.modified = True
-        params.update(timeout=reload_time - time.time())
-        params.update(reload_time=reload_time, interval=interval)
         if os.path.isfile(job.workfile('log')):
             # Does not exist until pconsc starts running (eg: not in data
             # staging) Pull last 400 lines from log (there will about 150 in a
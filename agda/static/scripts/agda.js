@@ -1,17 +1,33 @@
 /*
- * Put a self-updating countdown inside the element, 
- * and reload page without cache when it reaches zero.  
+ * Wait for the job status to change from status, by long-polling url
+ * (see jobs.views.wait_for_status), and reload page without cache when it
+ * does. Back off exponentially while the server cannot be reached.
  */
-page_reload_countdown = function(element, timeout) {
-	t0 = (new Date()).getTime() + timeout;
-	window.setInterval(function(element, t0) {
-		var now = (new Date()).getTime();
-		var timeout = Math.floor(Math.max(0, (t0 - now) / 1000));
-		$(element).html(page_reload_countdown.msg(timeout));
-	}, 250, element, t0);
-	window.setTimeout(function(element) { location.reload(true); }, timeout);
+wait_for_job_status = function(url, status) {
+	var retry = 5000;
+	var poll = function() {
+		$.ajax({
+			url: url,
+			data: {status: status},
+			dataType: 'json',
+			cache: false,
+			success: function(data) {
+				retry = 5000;
+				if (data.changed) {
+					location.reload(true);
+				} else {
+					poll();
+				}
+			},
+			error: function() {
+				window.setTimeout(poll, retry);
+				retry = Math.min(2 * retry, 300000);
+			}
+		});
+	};
+	poll();
 }
-page_reload_countdown.msg = function (timeout) { return "This page will automatically reload in <b>" + timeout + "</b> seconds." }
+wait_for_job_status.msg = "This page will automatically reload when the job status changes."
 
 /*
  * Find the element 'find' that shares and ancestor 